@@ -0,0 +1,117 @@
+import asyncio
+import resource
+import threading
+import time
+import psutil
+from logging_config import logger  # 使用外部的日志配置
+
+# AIMD 参数：每个调整周期加性增加 1，乘性减少到 DECREASE_FACTOR 倍
+ADJUST_INTERVAL = 5.0  # 调整周期（秒）
+DECREASE_FACTOR = 0.7
+THROUGHPUT_TOLERANCE = 0.9  # 吞吐不低于上个周期的 90% 视为仍在上升或持平
+TIMEOUT_SPIKE = 0.15  # 超时率比基线高出该值视为激增
+MIN_TIMEOUTS_FOR_SPIKE = 3  # 超时数太少时不判断激增，避免小样本抖动
+FD_USAGE_LIMIT = 0.8  # 打开的文件描述符超过软限制的 80% 时减少并发
+
+def fd_usage():
+    """返回当前进程已用文件描述符占软限制的比例，无法获取时返回 0"""
+    try:
+        soft_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if soft_limit <= 0 or soft_limit == resource.RLIM_INFINITY:
+            return 0.0
+        return psutil.Process().num_fds() / soft_limit
+    except (AttributeError, OSError, psutil.Error):
+        return 0.0
+
+class AIMDController:
+    """检测阶段的 AIMD 自适应并发控制器
+
+    吞吐上升且超时率平稳时每个周期并发数加 1；CPU 使用率达到 cpu_limit、文件描述符接近上限
+    或超时率激增时并发数乘以 DECREASE_FACTOR。内部加锁，可以在多个线程中记录结果。
+    """
+
+    def __init__(self, name, initial, maximum, cpu_limit=90, minimum=1):
+        self.name = name
+        self.initial = max(minimum, min(initial, maximum))
+        self.limit = self.initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cpu_limit = cpu_limit
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.timeouts = 0
+        self.window_start = time.monotonic()
+        self.last_throughput = 0.0
+        self.timeout_baseline = 0.0
+        self.history = [self.limit]
+        psutil.cpu_percent(interval=None)  # 第一次调用只用于建立采样基准
+
+    def record_completion(self):
+        with self.lock:
+            self.completed += 1
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def maybe_adjust(self):
+        """到达调整周期时根据吞吐、超时率和 CPU 使用率调整并发数，返回当前并发数"""
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.window_start
+            if elapsed < ADJUST_INTERVAL:
+                return self.limit
+
+            completed, timeouts = self.completed, self.timeouts
+            self.completed = self.timeouts = 0
+            self.window_start = now
+
+            throughput = completed / elapsed
+            timeout_rate = timeouts / completed if completed else 0.0
+            cpu = psutil.cpu_percent(interval=None)
+            fds = fd_usage()
+            timeout_spike = timeouts >= MIN_TIMEOUTS_FOR_SPIKE and timeout_rate > self.timeout_baseline + TIMEOUT_SPIKE
+
+            previous = self.limit
+            if cpu >= self.cpu_limit or fds >= FD_USAGE_LIMIT or timeout_spike:
+                self.limit = max(self.minimum, int(self.limit * DECREASE_FACTOR))
+            elif throughput >= self.last_throughput * THROUGHPUT_TOLERANCE and self.limit < self.maximum:
+                self.limit += 1
+
+            if not timeout_spike:
+                self.timeout_baseline = 0.8 * self.timeout_baseline + 0.2 * timeout_rate
+            self.last_throughput = throughput
+            self.history.append(self.limit)
+
+            if self.limit != previous:
+                logger.info(f"[{self.name}] concurrency {previous} -> {self.limit} "
+                            f"(throughput {throughput:.2f}/s, timeout rate {timeout_rate:.0%}, CPU {cpu:.0f}%, FD {fds:.0%})")
+            return self.limit
+
+    def log_summary(self):
+        """记录本轮检测选择的并发数，便于调整配置"""
+        with self.lock:
+            history = self.history
+            logger.info(f"[{self.name}] adaptive concurrency summary: initial {self.initial}, "
+                        f"min {min(history)}, max {max(history)}, average {sum(history) / len(history):.1f}, "
+                        f"final {self.limit} (bounds {self.minimum}-{self.maximum})")
+
+class AsyncAdaptiveLimiter:
+    """事件循环中使用的动态并发名额，async with 进入时等待名额"""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.controller.limit)
+            self.in_flight += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.controller.record_completion()
+        async with self.condition:
+            self.in_flight -= 1
+            limit = self.controller.maybe_adjust()
+            self.condition.notify(max(limit - self.in_flight, 0))
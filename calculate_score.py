@@ -1,79 +1,124 @@
+import numpy as np
+import pandas as pd
+
+# 权重设定
+WEIGHT_LATENCY = 0.3
+WEIGHT_DOWNLOAD_SPEED = 0.3
+WEIGHT_RESOLUTION = 0.08
+WEIGHT_FORMAT = 0.07
+WEIGHT_STABILITY = 0.15
+WEIGHT_SUCCESS_RATE = 0.1
+
+# 分辨率区间：高度不低于下限即归入该档，1081、1088 等非标准高度归入最接近的标准档位
+RESOLUTION_BUCKETS = [
+    (460, "480p"),
+    (560, "576p"),
+    (700, "720p"),
+    (1050, "1080p"),
+    (1400, "2K"),
+    (2100, "4K")
+]
+
+# 分辨率评分映射
+RESOLUTION_SCORES = {
+    "480p": 0.5,
+    "576p": 1.0,
+    "720p": 1.5,
+    "1080p": 2.0,
+    "2K": 2.5,
+    "4K": 3.0,
+    "Unknown": 0.5
+}
+
+# 格式评分映射
+FORMAT_SCORES = {
+    "hevc": 1.2,
+    "h264": 1.0,
+    "avs2": 0.8,
+    "mpeg2video": 0.7,
+    "cavs": 0.5,
+    "Unknown": 0.1
+}
+
+MAX_LATENCY = 10.0  # 最大延迟（秒）
+MAX_DOWNLOAD_SPEED = 80.0  # 最大下载速度（Mbps）
+
+# 向量化评分使用的区间下限和对应评分，下标 0 表示低于最低一档
+BUCKET_LOWER_BOUNDS = np.array([lower for lower, _ in RESOLUTION_BUCKETS])
+BUCKET_SCORES = np.array([RESOLUTION_SCORES["Unknown"]] + [RESOLUTION_SCORES[label] for _, label in RESOLUTION_BUCKETS])
+
 def initialize_stability_and_success_rate():
     # 初始化默认的稳定性和成功率
     initial_stability = 0.9
     initial_success_rate = 0.95
     return initial_stability, initial_success_rate
 
-def update_stability_and_success_rate(previous_stability, previous_success_rate, success):
-    if success:
-        # 如果成功，可以微调增加稳定性和成功率
-        new_stability = min(previous_stability + 0.01, 1.0)
-        new_success_rate = min(previous_success_rate + 0.01, 1.0)
-    else:
-        # 如果失败，可以适当降低稳定性和成功率
-        new_stability = max(previous_stability - 0.05, 0.0)
-        new_success_rate = max(previous_success_rate - 0.05, 0.0)
-    
-    return new_stability, new_success_rate
-
-def calculate_score(resolution_value, format, latency, download_speed, stability, success_rate, previous_score=0):
-    # 分辨率值到字符串的映射
-    resolution_map = {
-        480: "480p",
-        576: "576p",
-        720: "720p",
-        1080: "1080p",
-        1440: "2K",
-        2160: "4K"
-    }
-
-    resolution = resolution_map.get(resolution_value, "Unknown")
-
-    # 权重设定
-    weight_latency = 0.3
-    weight_download_speed = 0.3
-    weight_resolution = 0.08
-    weight_format = 0.07
-    weight_stability = 0.15
-    weight_success_rate = 0.1
-
-    # 分辨率评分映射
-    resolution_scores = {
-        "480p": 0.5,
-        "576p": 1.0,
-        "720p": 1.5,
-        "1080p": 2.0,
-        "2K": 2.5,
-        "4K": 3.0,
-        "Unknown": 0.5
-    }
-
-    # 格式评分映射
-    format_scores = {
-        "hevc": 1.2,
-        "h264": 1.0,
-        "avs2": 0.8,
-        "mpeg2video": 0.7,
-        "cavs": 0.5,
-        "Unknown": 0.1
-    }
-
-    resolution_score = resolution_scores.get(resolution, 1.0)
-    format_score = format_scores.get(format, 0.1)
-
-    max_latency = 10.0  # 最大延迟（秒）
-    max_download_speed = 80.0  # 最大下载速度（Mbps）
-
-    latency_score = max(0, 1 - (latency / max_latency))  # 延迟越低，分数越高
-    download_speed_score = min(download_speed / max_download_speed, 1)  # 下载速度越高，分数越高
-
-    score = (weight_latency * latency_score +
-             weight_download_speed * download_speed_score +
-             weight_resolution * resolution_score +
-             weight_format * format_score +
-             weight_stability * stability +
-             weight_success_rate * success_rate)
-
-    total_score = round(previous_score + score, 4)  # 结合之前的评分并保留4位小数
-
-    return total_score
+def resolution_label(resolution_value):
+    """按区间把视频高度归入分辨率档位，无法识别时返回 Unknown"""
+    try:
+        height = int(resolution_value)
+    except (TypeError, ValueError):
+        return "Unknown"
+    label = "Unknown"
+    for lower, bucket_label in RESOLUTION_BUCKETS:
+        if height >= lower:
+            label = bucket_label
+    return label
+
+def calculate_scores(resolution_values, formats, latency, download_speed, stability, success_rate):
+    """一次向量化计算一批直播源的评分
+
+    参数可以是 NumPy 数组、pandas Series 或列表，也可以是对所有直播源相同的标量。
+    latency 单位为秒，download_speed 单位为 Mbps，返回保留 4 位小数的评分数组。
+    """
+    heights = pd.to_numeric(pd.Series(resolution_values, dtype=object), errors='coerce').fillna(0).to_numpy()
+    resolution_score = BUCKET_SCORES[np.searchsorted(BUCKET_LOWER_BOUNDS, heights, side='right')]
+    format_score = pd.Series(formats, dtype=object).map(FORMAT_SCORES).fillna(FORMAT_SCORES["Unknown"]).to_numpy(dtype=float)
+
+    latency_score = np.maximum(0, 1 - np.asarray(latency, dtype=float) / MAX_LATENCY)  # 延迟越低，分数越高
+    download_speed_score = np.minimum(np.asarray(download_speed, dtype=float) / MAX_DOWNLOAD_SPEED, 1)  # 下载速度越高，分数越高
+
+    score = (WEIGHT_LATENCY * latency_score +
+             WEIGHT_DOWNLOAD_SPEED * download_speed_score +
+             WEIGHT_RESOLUTION * resolution_score +
+             WEIGHT_FORMAT * format_score +
+             WEIGHT_STABILITY * np.asarray(stability, dtype=float) +
+             WEIGHT_SUCCESS_RATE * np.asarray(success_rate, dtype=float))
+
+    return np.round(score, 4)  # 保留4位小数
+
+def score_frame(df):
+    """按 DataFrame 的 resolution、format、latency、download_speed、stability、success_rate 列计算评分"""
+    return calculate_scores(df["resolution"], df["format"], df["latency"], df["download_speed"],
+                            df["stability"], df["success_rate"])
+
+def calculate_score(resolution_value, format, latency, download_speed, stability, success_rate):
+    # 单个直播源的评分，与批量评分使用相同的计算
+    return float(calculate_scores([resolution_value], [format], latency, download_speed, stability, success_rate)[0])
+
+def rescore_table(conn, table='filtered_playlists'):
+    """用当前权重按测速统计重新计算整张表的评分，返回更新的行数
+
+    延迟单位为毫秒、下载速度单位为 KB/s，未测速的直播源按最大延迟计算。
+    """
+    from source_stats import load_score_inputs  # source_stats 依赖本模块，在函数内导入避免循环导入
+
+    df = load_score_inputs(conn, table)
+    df["latency"] = pd.to_numeric(df["latency"], errors='coerce').fillna(MAX_LATENCY * 1000) / 1000
+    df["download_speed"] = pd.to_numeric(df["download_speed"], errors='coerce').fillna(0) / 1024
+    df["score"] = score_frame(df)
+
+    with conn:
+        conn.executemany(f"UPDATE {table} SET score = ? WHERE id = ?", zip(df["score"].tolist(), df["id"].tolist()))
+    return len(df)
+
+if __name__ == "__main__":
+    import sqlite3
+    from logging_config import logger  # 使用外部的日志配置
+
+    # 调整权重后执行 python calculate_score.py 重新计算 filtered_playlists 的评分
+    conn = sqlite3.connect('data/iptv_sources.db')
+    try:
+        logger.info(f"Rescored {rescore_table(conn)} sources in filtered_playlists.")
+    finally:
+        conn.close()
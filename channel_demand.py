@@ -0,0 +1,95 @@
+import atexit
+import sqlite3
+import threading
+from collections import Counter
+from logging_config import logger  # 使用外部的日志配置
+
+DEMAND_DB_PATH = 'data/channel_demand.db'
+
+def setup_demand_table(conn):
+    """按小时累计的频道访问次数，单独保存在 channel_demand.db 中，避免重定向服务器写主数据库"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS channel_demand (
+        aliasesname TEXT NOT NULL,
+        hour TIMESTAMP NOT NULL,
+        hits INTEGER NOT NULL,
+        PRIMARY KEY (aliasesname, hour)
+    )
+    ''')
+
+class DemandCounter:
+    """重定向服务器使用的频道访问计数
+
+    每次重定向只在内存中加一，后台线程每 flush_seconds 秒把累计次数写入数据库，
+    并删除 window_hours 小时之前的记录。
+    """
+
+    def __init__(self, db_path=DEMAND_DB_PATH, flush_seconds=60, window_hours=24):
+        self.db_path = db_path
+        self.flush_seconds = flush_seconds
+        self.window_hours = window_hours
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def hit(self, aliasesname):
+        with self.lock:
+            self.counts[aliasesname] += 1
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return
+
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            try:
+                with conn:
+                    setup_demand_table(conn)
+                    conn.executemany('''
+                    INSERT INTO channel_demand (aliasesname, hour, hits)
+                    VALUES (?, strftime('%Y-%m-%d %H:00:00', 'now', 'localtime'), ?)
+                    ON CONFLICT (aliasesname, hour) DO UPDATE SET hits = hits + excluded.hits
+                    ''', counts.items())
+                    conn.execute("DELETE FROM channel_demand WHERE hour < datetime('now', 'localtime', ?)", (f'-{self.window_hours} hours',))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to flush channel demand counters: {e}")
+            with self.lock:
+                self.counts.update(counts)  # 写入失败时保留计数，下次再写
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_seconds):
+            self.flush()
+
+    def start(self):
+        threading.Thread(target=self.run, name='demand-flush', daemon=True).start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.stop_event.set()
+        self.flush()
+
+def load_demand(db_path=DEMAND_DB_PATH, window_hours=24):
+    """返回最近 window_hours 小时内每个频道的访问次数"""
+    try:
+        conn = sqlite3.connect(db_path, timeout=10)
+        try:
+            setup_demand_table(conn)
+            rows = conn.execute('''
+            SELECT aliasesname, SUM(hits) FROM channel_demand
+            WHERE hour >= datetime('now', 'localtime', ?)
+            GROUP BY aliasesname
+            ''', (f'-{window_hours} hours',)).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Failed to load channel demand: {e}")
+        return {}
+    return dict(rows)
+
+def probe_interval_minutes(hits, min_interval, max_interval):
+    """根据频道访问次数计算测速间隔：没有访问的频道每 max_interval 分钟测一次，访问越多间隔越短，最短 min_interval"""
+    return max(min_interval, max_interval / (1 + hits))
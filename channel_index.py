@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import threading
+import time
+from logging_config import logger  # 使用外部的日志配置
+
+class ChannelIndex:
+    """重定向服务器使用的内存频道索引
+
+    把只读快照一次性加载为 {aliasesname: ((url, weight), ...)}，直播源按评分从高到低排列，
+    weight 为评分与下载速度的乘积，供负载均衡按权重分配。
+    请求处理时只查字典。快照文件的 mtime、大小或 inode 变化时（原子替换或增量同步）
+    由发现变化的请求线程重新加载，完成后整体替换字典，其他线程继续使用旧索引，不会看到加载一半的数据。
+    """
+
+    def __init__(self, snapshot_path, check_seconds=1.0):
+        self.snapshot_path = snapshot_path
+        self.check_seconds = check_seconds  # 两次检查快照文件之间的最短间隔
+        self.routes = {}
+        self.version = 0
+        self.file_key = None
+        self.next_check = 0.0
+        self.reload_lock = threading.Lock()
+
+    def lookup(self, aliasesname):
+        """返回频道按评分排列的 (url, weight) 元组，频道不存在或没有可用直播源时返回空元组"""
+        self.maybe_reload()
+        return self.routes.get(aliasesname, ())
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        # 同一时间只有一个线程检查和加载，其他线程直接使用当前索引
+        if not self.reload_lock.acquire(blocking=False):
+            return
+        try:
+            self.next_check = now + self.check_seconds
+            try:
+                stat = os.stat(self.snapshot_path)
+            except OSError:
+                return
+            file_key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if file_key != self.file_key:
+                self.load(file_key)
+        finally:
+            self.reload_lock.release()
+
+    def load(self, file_key):
+        try:
+            conn = sqlite3.connect(f'file:{self.snapshot_path}?mode=ro', uri=True)
+            try:
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                rows = conn.execute('''
+                SELECT aliasesname, url, score, download_speed FROM filtered_playlists_readonly
+                WHERE download_speed > 0
+                AND latency IS NOT NULL
+                ORDER BY aliasesname, score DESC  -- 根据评分机制选择直播源
+                ''').fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # 加载失败时继续使用旧索引，下次检查时重试
+            logger.error(f"Failed to load channel index from {self.snapshot_path}: {e}")
+            return
+
+        routes = {}
+        for aliasesname, url, score, download_speed in rows:
+            routes.setdefault(aliasesname, []).append((url, max(0.0, (score or 0) * (download_speed or 0))))
+        self.routes = {aliasesname: tuple(candidates) for aliasesname, candidates in routes.items()}
+        self.file_key = file_key
+        self.version = version
+        logger.info(f"Loaded channel index version {version}: {len(self.routes)} channels, {len(rows)} sources.")
@@ -1,14 +1,26 @@
 import sqlite3
 import json
-import subprocess
 import time
-import re
-import pandas as pd
-import concurrent.futures
+import heapq
+import signal
+import argparse
 import aiohttp
 import asyncio
 import os
-from calculate_score import calculate_score, update_stability_and_success_rate
+from calculate_score import calculate_scores, MAX_LATENCY
+from source_stats import SourceStats, downsample_measurements  # 测速历史与 EWMA 统计
+from snapshot import publish_snapshot, refresh_snapshot  # 原子发布和增量同步只读快照
+from playlist_export import export_source_playlist, export_aggregated_playlist  # 流式导出 M3U
+from export_report import write_excel_report  # Excel 报表
+from host_health import HostHealth, CONNECT_ERRORS, host_of, interleave_by_host  # 主机级熔断
+from result_writer import BatchWriter, stage_ids  # 批量写入检测结果
+from run_journal import start_run, journal_batch, finish_run  # 可恢复的检测轮次
+from adaptive_concurrency import AIMDController, AsyncAdaptiveLimiter  # 自适应并发控制
+from process_runner import run_process_lines  # 异步子进程运行器
+from throughput_sampler import ThroughputSampler  # 自适应测速窗口
+from stream_measure import measure_stream  # 单连接测量延迟和下载速度
+from channel_demand import load_demand  # 频道访问次数
+from probe_schedule import setup_schedule_table, select_due_sources, schedule_next, load_schedule, next_due_time  # 按访问量安排测速
 from logging_config import logger  # 使用外部的日志配置
 
 logger.info("开始执行 下载速度检测 任务")
@@ -44,176 +56,311 @@ if THREADS == 0:
 LATENCY_LIMIT = float(os.getenv('LATENCY_LIMIT', config['source_checker']['latency_limit'])) / 1000  # 转换为秒,检测的延迟
 RETRY_LIMIT = int(os.getenv('RETRY_LIMIT', config['source_checker']['retry_limit']))  # 重试次数
 FAILURE_THRESHOLD = int(os.getenv('FAILURE_THRESHOLD', config['source_checker']['failure_threshold']))  # 最大失败次数阈值
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', config['source_checker'].get('write_batch_size', 500)))  # 每个事务写入的检测结果数
 HOST_IP = os.getenv('HOST_IP', config['network']['host_ip'])
 PORT = int(os.getenv('PORT', int(config["network"]["port"])))
-
-def convert_to_kb(size, unit):
-    size = float(size)
-    unit = unit.lower()
-    if 'm' in unit:
-        return size * 1024
-    elif 'g' in unit:
-        return size * 1024 * 1024
-    elif 'k' in unit:
-        return size
-    else:
-        return size / 1024
-
-async def check_latency(url):
-    async with aiohttp.ClientSession() as session:
-        try:
-            start_time = time.time()
-            async with session.get(url, timeout=LATENCY_LIMIT) as response:
-                latency = int((time.time() - start_time) * 1000)  # 将延迟转换为毫秒并保留整数
-                if response.status == 200:
-                    return latency
-                else:
-                    logger.warning(f"Invalid response {response.status} for URL: {url}")
-                    return None
-        except Exception as e:
-            logger.error(f"Error checking latency for URL {url}: {e}")
-            return None
-
-def get_stream_info(url, duration, threads=THREADS):
-    command = [
-        'ffmpeg',
-        '-threads', str(threads),
-        '-i', url,
-        '-t', str(duration),
-        '-f', 'null',
-        '-loglevel', 'info',
-        '-'
-    ]
+MONITOR_LIMIT_PER_HOST = int(os.getenv('MONITOR_LIMIT_PER_HOST', config['source_checker'].get('monitor_limit_per_host', 1)))  # 单个主机同时测速的最大直播源数
+HOST_FAILURE_THRESHOLD = int(os.getenv('HOST_FAILURE_THRESHOLD', config['source_checker'].get('host_failure_threshold', 3)))  # 主机连续连接失败次数阈值，0 表示不熔断
+
+# 自适应并发：THREADS 作为初始并发数，运行中在 1 到 MAX_THREADS 之间调整
+ADAPTIVE_CONCURRENCY = str(os.getenv('ADAPTIVE_CONCURRENCY', config['source_checker'].get('adaptive_concurrency', True))).lower() in ('1', 'true', 'yes')
+MAX_THREADS = int(os.getenv('MAX_THREADS', config['source_checker'].get('max_threads', 0)))  # 0 表示 THREADS 的 4 倍
+if MAX_THREADS == 0:
+    MAX_THREADS = THREADS * 4
+if not ADAPTIVE_CONCURRENCY:
+    MAX_THREADS = THREADS
+CPU_LIMIT_PERCENT = int(os.getenv('CPU_LIMIT_PERCENT', config['source_checker'].get('cpu_limit_percent', 90)))  # CPU 使用率达到该值时减少并发
+MEASURE_MODE = os.getenv('MEASURE_MODE', config['source_checker'].get('measure_mode', 'http'))  # 测速方式：http 为进程内单连接测量，ffmpeg 为 ffmpeg 转封装拉流测量
+DEEP_CHECK = str(os.getenv('DEEP_CHECK', config['source_checker'].get('deep_check', False))).lower() in ('1', 'true', 'yes')  # 深度检测：测速时用 ffmpeg 完整解码视频
+SPEED_MAX_SECONDS = float(os.getenv('SPEED_MAX_SECONDS', config['source_checker'].get('speed_max_seconds', 6)))  # 测速最长采样时间（秒）
+SPEED_TOLERANCE = float(os.getenv('SPEED_TOLERANCE', config['source_checker'].get('speed_tolerance', 0.1)))  # 吞吐估计波动不超过该比例时提前结束测速
+SPEED_WARMUP_SECONDS = float(os.getenv('SPEED_WARMUP_SECONDS', config['source_checker'].get('speed_warmup_seconds', 1)))  # 不计入测速的启动阶段（秒）
+EXCEL_REPORT = str(os.getenv('EXCEL_REPORT', config['source_checker'].get('excel_report', False))).lower() in ('1', 'true', 'yes')  # 每轮测速后是否生成 Excel 报表
+SCORE_EWMA_ALPHA = float(os.getenv('SCORE_EWMA_ALPHA', config['source_checker'].get('score_ewma_alpha', 0.3)))  # 评分统计的 EWMA 平滑系数，越大越看重最近的测速
+MEASUREMENT_RAW_DAYS = int(os.getenv('MEASUREMENT_RAW_DAYS', config['source_checker'].get('measurement_raw_days', 7)))  # 保留逐次测速记录的天数，更早的按天合并
+MEASUREMENT_RETENTION_DAYS = int(os.getenv('MEASUREMENT_RETENTION_DAYS', config['source_checker'].get('measurement_retention_days', 90)))  # 测速历史保留天数
+SPEED_SAMPLE_INTERVAL = int(os.getenv('SPEED_SAMPLE_INTERVAL_MS', config['source_checker'].get('speed_sample_interval_ms', 250))) / 1000  # 采样间隔，转换为秒
+
+# 按频道访问量安排测速：访问多的频道每轮都测，没人看的频道逐渐退到 DEMAND_MAX_INTERVAL_MINUTES 测一次
+DEMAND_SCHEDULING = str(os.getenv('DEMAND_SCHEDULING', config['scheduler'].get('demand_scheduling', True))).lower() in ('1', 'true', 'yes')
+DEMAND_WINDOW_HOURS = int(os.getenv('DEMAND_WINDOW_HOURS', config['scheduler'].get('demand_window_hours', 24)))  # 统计访问次数的时间窗口（小时）
+DEMAND_MAX_INTERVAL_MINUTES = int(os.getenv('DEMAND_MAX_INTERVAL_MINUTES', config['scheduler'].get('demand_max_interval_minutes', 1440)))  # 没有访问的频道的测速间隔（分钟）
+MONITOR_INTERVAL_MINUTES = int(config['scheduler']['interval_minutes'])  # 最短测速间隔即测速任务的运行间隔
+DAEMON_PUBLISH_SECONDS = int(os.getenv('DAEMON_PUBLISH_SECONDS', config['scheduler'].get('daemon_publish_seconds', 60)))  # 常驻模式下写入结果并同步快照的间隔（秒）
+DAEMON_REFRESH_SECONDS = 60  # 常驻模式下重新读取直播源列表和频道访问次数的间隔（秒）
+DAEMON_SHUTDOWN_SECONDS = 30  # 常驻模式停止时等待进行中检测完成的最长时间（秒），超时的检测被取消
+
+DNS_CACHE_TTL = 300  # 连接池 DNS 缓存时间（秒）
+
+host_health = HostHealth(HOST_FAILURE_THRESHOLD)
+concurrency = AIMDController('daily_monitor', THREADS, MAX_THREADS, CPU_LIMIT_PERCENT)
+
+def new_sampler():
+    """按配置创建一个自适应测速窗口"""
+    return ThroughputSampler(SPEED_MAX_SECONDS, SPEED_SAMPLE_INTERVAL, SPEED_TOLERANCE, SPEED_WARMUP_SECONDS)
+
+async def check_latency(session, url):
     try:
         start_time = time.time()
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=duration + 2, encoding='utf-8', errors='ignore')
-        elapsed_time = time.time() - start_time
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=LATENCY_LIMIT)) as response:
+            latency = int((time.time() - start_time) * 1000)  # 将延迟转换为毫秒并保留整数
+            host_health.record_success(host_of(url))
+            if response.status == 200:
+                return latency
+            else:
+                logger.warning(f"Invalid response {response.status} for URL: {url}")
+                return None
+    except CONNECT_ERRORS as e:
+        if isinstance(e, asyncio.TimeoutError):
+            concurrency.record_timeout()
+        host_health.record_failure(host_of(url))
+        logger.error(f"Error checking latency for URL {url}: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Error checking latency for URL {url}: {e}")
+        return None
 
-        # 忽略初始波动时间
-        ignore_initial_seconds = 2
-        effective_time = max(elapsed_time - ignore_initial_seconds, 0.5)  # 设置最小值为0.5秒
+async def measure_source(session, url):
+    """在一个连接上测量延迟和下载速度，返回 (延迟毫秒, 下载速度 KB/s)，请求失败时延迟为 None"""
+    timeout = aiohttp.ClientTimeout(sock_connect=LATENCY_LIMIT, sock_read=LATENCY_LIMIT)
+    try:
+        latency, download_speed = await measure_stream(session, url, new_sampler(), timeout)
+        host_health.record_success(host_of(url))
+        if latency is None:
+            logger.warning(f"Invalid response for URL: {url}")
+        return latency, download_speed
+    except CONNECT_ERRORS as e:
+        if isinstance(e, asyncio.TimeoutError):
+            concurrency.record_timeout()
+        host_health.record_failure(host_of(url))
+        logger.error(f"Error measuring stream {url}: {e}")
+        return None, 0
+    except Exception as e:
+        logger.error(f"Error measuring stream {url}: {e}")
+        return None, 0
+
+# 默认以 -c copy 转封装拉流，只统计字节数不解码；深度检测额外完整解码视频，用于需要确认能正常解码的直播源
+# 下载量取自 -progress 输出中第一个输出文件（转封装输出）的 total_size，吞吐稳定后提前结束 ffmpeg
+async def get_stream_info(url, deep_check=DEEP_CHECK):
+    command = ['ffmpeg', '-nostdin', '-v', 'error', '-nostats', '-progress', 'pipe:1']
+    if deep_check:
+        command += ['-threads', '1']  # 解码器使用单线程，并发由全局并发数控制
+    command += [
+        '-t', str(SPEED_MAX_SECONDS),  # 作为输入选项限制读取时长，对所有输出生效
+        '-i', url,
+        '-map', '0:v?', '-map', '0:a?', '-c', 'copy', '-f', 'mpegts', '-y', os.devnull
+    ]
+    if deep_check:
+        command += ['-map', '0:v?', '-f', 'null', '-']
 
-        stderr_output = result.stderr
-        video_match = re.search(r'video:\s*([\d\.]+)([kKMG]?i?B)', stderr_output)
-        audio_match = re.search(r'audio:\s*([\d\.]+)([kKMG]?i?B)', stderr_output)
+    sampler = new_sampler()
 
-        video_size = convert_to_kb(video_match.group(1), video_match.group(2)) if video_match else 0
-        audio_size = convert_to_kb(audio_match.group(1), audio_match.group(2)) if audio_match else 0
-        total_size = video_size + audio_size
+    def on_progress(line):
+        key, _, value = line.partition('=')
+        if key == 'total_size' and value.isdigit():
+            sampler.update(int(value))
+        return sampler.done()
 
-        download_speed = round(total_size / effective_time) if effective_time > 0 else 0
+    try:
+        returncode, stderr, stopped = await run_process_lines(command, on_progress, timeout=SPEED_MAX_SECONDS + LATENCY_LIMIT + 2)
+        if returncode != 0 and not stopped:
+            logger.warning(f"ffmpeg exited with {returncode} for {url}: {stderr.decode('utf-8', errors='ignore').strip()[-200:]}")
+            return {"download_speed": 0}
 
         return {
-            "download_speed": download_speed
+            "download_speed": sampler.speed()
         }
 
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
+        concurrency.record_timeout()
         logger.error(f"Timeout occurred for {url}")
         return {"download_speed": 0}
     except Exception as e:
         logger.error(f"Error processing stream {url}: {e}")
         return {"download_speed": 0}
 
-def handle_failed_stream(source, cursor):
-    try:
-        cursor.execute('''
-        UPDATE iptv_playlists 
-        SET failure_count = failure_count + 1, last_failed_date = datetime('now', 'localtime')
-        WHERE url = ? AND tvg_name = ?
-        ''', (source['url'], source['tvg_name']))
-
-        cursor.execute('''
-        DELETE FROM filtered_playlists WHERE id = ?
-        ''', (source['id'],))
-
-        logger.info(f"Source {source['id']} moved to iptv_playlists due to exceeding failure threshold.")
-        
-    except sqlite3.OperationalError as e:
-        logger.error(f"Database operation failed: {e}")
+def score_results(results, stats):
+    """按测速统计一次计算一批直播源的评分，延迟换算为秒，下载速度换算为 MB/s
+
+    没有成功测速记录的直播源按最大延迟、零下载速度计算。
+    """
+    if not results:
+        return
+    inputs = [stats.get(result["id"]) for result in results]
+    scores = calculate_scores(
+        [result["resolution"] for result in results],
+        [result["format"] for result in results],
+        [latency / 1000 if latency is not None else MAX_LATENCY for latency, _, _, _ in inputs],
+        [(speed or 0) / 1024 for _, speed, _, _ in inputs],
+        [stability for _, _, stability, _ in inputs],
+        [success_rate for _, _, _, success_rate in inputs]
+    )
+    for result, score in zip(results, scores):
+        result["score"] = float(score)
+
+def save_results(cursor, successes, failures):
+    """在一个事务中批量写入一批测速结果，失败阈值的处理使用基于集合的 SQL"""
+    cursor.executemany('''
+        UPDATE filtered_playlists
+        SET latency = ?, download_speed = ?, score = ?, failure_count = 0, last_failed_date = NULL
+        WHERE id = ?
+    ''', [(result["latency"], result["download_speed"], result["score"], result["id"]) for result in successes])
+
+    if not failures:
+        return
+
+    cursor.executemany('''
+    UPDATE filtered_playlists
+    SET latency = NULL, download_speed = NULL, failure_count = failure_count + 1, last_failed_date = datetime('now', 'localtime'), score = ?
+    WHERE id = ?
+    ''', [(source["score"], source["id"]) for source in failures])
+
+    # 达到失败阈值的直播源退回 iptv_playlists 重新进入分辨率检测
+    stage_ids(cursor, [source["id"] for source in failures])
+    cursor.execute('''
+    UPDATE iptv_playlists
+    SET failure_count = failure_count + 1, last_failed_date = datetime('now', 'localtime')
+    WHERE (url, tvg_name) IN (
+        SELECT url, tvg_name FROM filtered_playlists
+        WHERE id IN (SELECT id FROM batch_ids) AND failure_count >= ?
+    )
+    ''', (FAILURE_THRESHOLD,))
+    cursor.execute('''
+    DELETE FROM filtered_playlists
+    WHERE id IN (SELECT id FROM batch_ids) AND failure_count >= ?
+    ''', (FAILURE_THRESHOLD,))
+    if cursor.rowcount > 0:
+        logger.info(f"{cursor.rowcount} sources moved to iptv_playlists due to exceeding failure threshold.")
+
+def write_batch(cursor, stats, successes, failures, demand=None, started_at=None):
+    """更新测速统计、评分并写入一批结果，demand 不为 None 时同时安排这些直播源的下一次测速
+
+    started_at 为本轮测速的开始时间，下一次测速从该时间起算。
+    """
+    for result in successes:
+        stats.observe(result["id"], result["latency"], result["download_speed"], True)
+    for source in failures:
+        stats.observe(source["id"], None, None, False)
+    score_results(successes + failures, stats)
+    save_results(cursor, successes, failures)
+    if demand is not None:
+        schedule_next(cursor, successes + failures, demand, MONITOR_INTERVAL_MINUTES, max_interval_minutes(), started_at)
+    stats.flush()
+
+def max_interval_minutes():
+    """没有访问的频道的测速间隔，关闭按访问量安排时所有直播源每个周期测一次"""
+    return DEMAND_MAX_INTERVAL_MINUTES if DEMAND_SCHEDULING else MONITOR_INTERVAL_MINUTES
+
+async def measure(session, url):
+    """按 MEASURE_MODE 测量延迟（毫秒）和下载速度（KB/s），开启深度检测时总是使用 ffmpeg"""
+    if MEASURE_MODE == 'ffmpeg' or DEEP_CHECK:
+        latency = await check_latency(session, url)
+        if latency is None or latency > LATENCY_LIMIT * 1000:
+            return latency, 0
+        return latency, (await get_stream_info(url))["download_speed"]
+    return await measure_source(session, url)
 
-def test_stream(source, cursor):
+async def test_stream(source, session):
     url = source["url"]
     retries = 0
 
+    # 主机已熔断时直接判定失败，不再等待超时
+    if host_health.is_tripped(host_of(url)):
+        logger.info(f"Skipping {url} because its host is unreachable in this run")
+        return None
+
     while retries <= RETRY_LIMIT:
-        latency = asyncio.run(check_latency(url))
+        latency, download_speed = await measure(session, url)
         if latency is None or latency > LATENCY_LIMIT * 1000:
             retries += 1
             logger.info(f"Retrying source due to high latency ({latency} ms): {url} ({retries}/{RETRY_LIMIT})")
             continue
 
-        previous_score = source.get("score", 0)
-        stability = source.get("stability", 0.9)
-        success_rate = source.get("success_rate", 0.95)
-
-        download_info = get_stream_info(url, LATENCY_LIMIT)
-        logger.info(f"Stream OK: {url} | Latency: {latency} ms | Download Speed: {download_info['download_speed']} KB/s")
-
-        if download_info["download_speed"] > 0:
-            stability, success_rate = update_stability_and_success_rate(stability, success_rate, True)
-            updated_score = calculate_score(
-                resolution_value=source.get("resolution_value", None),
-                format=source.get("format", None),
-                latency=latency / 1000,
-                download_speed=download_info["download_speed"] / 1024,
-                stability=stability,
-                success_rate=success_rate,
-                previous_score=previous_score
-            )
+        logger.info(f"Stream OK: {url} | Latency: {latency} ms | Download Speed: {download_speed} KB/s")
 
+        if download_speed > 0:
+            # 评分在批量写入时按测速统计统一计算
             return {
                 "id": source["id"],
+                "aliasesname": source.get("aliasesname"),
+                "resolution": source.get("resolution"),
+                "format": source.get("format"),
                 "latency": latency,
-                "download_speed": download_info["download_speed"],
-                "stability": stability,
-                "success_rate": success_rate,
-                "score": updated_score
+                "download_speed": download_speed
             }
         else:
             retries += 1
-            logger.info(f"Retrying source due to low download speed ({download_info['download_speed']} KB/s): {url} ({retries}/{RETRY_LIMIT})")
+            logger.info(f"Retrying source due to low download speed ({download_speed} KB/s): {url} ({retries}/{RETRY_LIMIT})")
 
     logger.info(f"Source failed after {RETRY_LIMIT} attempts: {url}")
     return None
 
+async def probe_sources(sources, on_result):
+    """在单个事件循环中并发测速所有直播源，共享一个带主机连接上限的连接池
+
+    同时测速的直播源数由自适应控制器在 THREADS 的基础上调整，
+    MONITOR_LIMIT_PER_HOST 限制同一主机同时测速的直播源数。
+    """
+    connector = aiohttp.TCPConnector(limit=MAX_THREADS, limit_per_host=MONITOR_LIMIT_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL)
+    limiter = AsyncAdaptiveLimiter(concurrency)
+    host_semaphores = {host_of(source["url"]): asyncio.BoundedSemaphore(MONITOR_LIMIT_PER_HOST) for source in sources}
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def bounded_test(source):
+            # 先占用主机名额再占用全局名额，等待繁忙主机时不占用全局并发
+            async with host_semaphores[host_of(source["url"])], limiter:
+                try:
+                    return source, await test_stream(source, session)
+                except Exception as e:
+                    logger.error(f"Unexpected error testing stream {source['url']}: {e}")
+                    return source, None
+
+        tasks = [asyncio.create_task(bounded_test(source)) for source in sources]
+        for task in asyncio.as_completed(tasks):
+            source, result = await task
+            on_result(source, result)
+
+    logger.info(f"{host_health.summary()} hosts short-circuited in this run.")
+    concurrency.log_summary()
+
 def run_tests():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
 
     try:
-        cursor.execute('UPDATE filtered_playlists SET latency = NULL, download_speed = NULL')
-        conn.commit()
-        
-        cursor.execute('SELECT id, url, score FROM filtered_playlists')
-        sources = cursor.fetchall()
-
-        results = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=THREADS) as executor:
-            results = list(executor.map(lambda src: test_stream(src, cursor), [{"id": source[0], "url": source[1], "score": source[2]} for source in sources]))
-
-        for index, result in enumerate(results):
-            source_id = sources[index][0]  # 获取原始 source 的 id
-            if result:
-                cursor.execute('''
-                    UPDATE filtered_playlists
-                    SET latency = ?, download_speed = ?, score = ?, failure_count = 0, last_failed_date = NULL
-                    WHERE id = ?
-                ''', (result["latency"], result["download_speed"], result["score"], result["id"]))
-            else:
-                cursor.execute('''
-                UPDATE filtered_playlists
-                SET failure_count = failure_count + 1, last_failed_date = datetime('now', 'localtime')
-                WHERE id = ?
-                ''', (source_id,))
-
-                cursor.execute('SELECT failure_count FROM filtered_playlists WHERE id = ?', (source_id,))
-                failure_count = cursor.fetchone()[0]
+        # 恢复被中断的一轮时保留已写入的测速结果，只检测尚未处理的直播源
+        # 失败的直播源在写入结果时清空延迟和速度，未到期的直播源保留上次的测速结果
+        run_id, done_ids, _ = start_run(conn, 'daily_monitor')
+        run_started_at = time.time()
 
-                if failure_count >= FAILURE_THRESHOLD:
-                    cursor.execute('SELECT url, tvg_name FROM filtered_playlists WHERE id = ?', (source_id,))
-                    url, tvg_name = cursor.fetchone()
+        stats = SourceStats(cursor, SCORE_EWMA_ALPHA)
+        setup_schedule_table(cursor)
+        conn.commit()
 
-                    handle_failed_stream({"id": source_id, "url": url, "tvg_name": tvg_name}, cursor)
+        if DEMAND_SCHEDULING:
+            demand = load_demand(window_hours=DEMAND_WINDOW_HOURS)
+            sources = select_due_sources(cursor)
+        else:
+            demand = {}
+            cursor.execute('SELECT id, url, resolution, format, aliasesname FROM filtered_playlists')
+            sources = cursor.fetchall()
+        total = cursor.execute('SELECT COUNT(*) FROM filtered_playlists').fetchone()[0]
+        sources = [source for source in sources if source[0] not in done_ids]
+        logger.info(f"{len(sources)} of {total} sources are due for testing ({len(demand)} channels watched in the last {DEMAND_WINDOW_HOURS} hours).")
+
+        # 按主机轮流排列，同一主机的直播源不会同时占满全局并发
+        sources = interleave_by_host([{"id": source[0], "url": source[1], "resolution": source[2], "format": source[3], "aliasesname": source[4]} for source in sources])
+
+        # 所有测速在同一个事件循环中完成，结果由单一写入者批量写入
+        def flush_batch(batch_cursor, successes, failures):
+            write_batch(batch_cursor, stats, successes, failures, demand if DEMAND_SCHEDULING else None, run_started_at)
+            journal_batch(batch_cursor, run_id, successes, failures)
+
+        writer = BatchWriter(conn, flush_batch, WRITE_BATCH_SIZE)
+        asyncio.run(probe_sources(sources, writer.add))
+        writer.close()
+        finish_run(conn, run_id)
+        downsample_measurements(conn, MEASUREMENT_RAW_DAYS, MEASUREMENT_RETENTION_DAYS)
 
         cursor.execute("DROP TABLE IF EXISTS filtered_playlists_readonly")
         cursor.execute("CREATE TABLE filtered_playlists_readonly AS SELECT * FROM filtered_playlists")
@@ -227,140 +374,241 @@ def run_tests():
 
         logger.info("filtered_playlists_readonly table creation time recorded successfully.")
 
-        df = pd.read_sql_query("SELECT * FROM filtered_playlists ORDER BY id", conn)
-
         # 将 filtered_playlists_readonly 表复制到新的数据库文件
         copy_table_to_new_db()
 
+        # 分批读取游标直接写出 M3U 文件
+        export_source_playlist(conn, 'data/filtered_sources.m3u8')
+        generate_m3u8_file(conn)
+
     finally:
         conn.close()
 
-    df['download_speed'] = pd.to_numeric(df['download_speed'], errors='coerce').fillna(0)
+    # Excel 报表较慢，默认不生成，可通过重定向服务器的 /filtered_sources.xlsx 按需下载
+    if EXCEL_REPORT:
+        try:
+            write_excel_report(NEW_DB_PATH, 'filtered_playlists_readonly', 'data/filtered_sources.xlsx')
+        except Exception as e:
+            logger.error(f"Error generating Excel report: {e}")
+
+    logger.info("Testing completed, results saved, and files generated.")
+
+class RollingMonitor:
+    """常驻测速：按下一次测速时间维护直播源的优先队列，以均匀的速率逐个测速
+
+    每个直播源测速后按频道访问量安排下一次测速时间，测速的发起间隔为
+    MONITOR_INTERVAL_MINUTES / 接下来一个周期内到期的直播源数，保证到期的直播源都能在周期内轮到，
+    网络和 CPU 负载保持平稳，测速之间不会互相争抢带宽。
+    结果每 DAEMON_PUBLISH_SECONDS 秒批量写入，并只把变化的直播源同步到只读快照；
+    导入或初步筛选任务修改数据库后完整发布一次快照。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.stats = SourceStats(self.cursor, SCORE_EWMA_ALPHA)
+        setup_schedule_table(self.cursor)
+        conn.commit()
 
-    def highlight_speed(cell):
+        self.demand = {}
+        self.sources = {}  # id -> 直播源
+        self.queue = []  # (下一次测速时间, id) 的最小堆
+        self.due_at = {}  # id -> 队列中有效的测速时间，用于惰性删除过期的堆元素
+        self.in_flight = set()
+        self.changed_ids = set()
+        self.full_publish = True  # 启动时完整发布一次，之前其他任务的修改也会进入快照
+        self.data_version = None  # 导入和初步筛选任务最后一次修改数据库的时间
+        self.due_soon = 0  # 接下来一个周期内到期的直播源数
+        self.host_semaphores = {}
+        self.stop_event = asyncio.Event()
+        self.writer = BatchWriter(conn, self.flush_batch, WRITE_BATCH_SIZE)
+
+    def flush_batch(self, cursor, successes, failures):
+        write_batch(cursor, self.stats, successes, failures, self.demand)
+        self.changed_ids.update(result["id"] for result in successes)
+        self.changed_ids.update(source["id"] for source in failures)
+
+    def push(self, source_id, due):
+        self.due_at[source_id] = due
+        heapq.heappush(self.queue, (due, source_id))
+
+    def refresh(self):
+        """重新读取直播源列表和频道访问次数，新增的直播源按已保存的时间或立即排入队列"""
+        if DEMAND_SCHEDULING:
+            self.demand = load_demand(window_hours=DEMAND_WINDOW_HOURS)
+        now = time.time()
+        sources = {}
+        for source_id, url, resolution, format_, aliasesname, next_due in load_schedule(self.cursor):
+            sources[source_id] = {"id": source_id, "url": url, "resolution": resolution, "format": format_, "aliasesname": aliasesname}
+            if source_id not in self.due_at and source_id not in self.in_flight:
+                self.push(source_id, next_due or now)
+
+        # 已被其他任务删除的直播源从队列和快照中移除
+        removed = self.sources.keys() - sources.keys()
+        for source_id in removed:
+            self.due_at.pop(source_id, None)
+        self.changed_ids.update(removed)
+        self.sources = sources
+
+        horizon = now + MONITOR_INTERVAL_MINUTES * 60
+        self.due_soon = sum(1 for due in self.due_at.values() if due <= horizon) + len(self.in_flight)
+
+        # import_playlists 和 ffmpeg_source_checker 会修改评分和直播源列表，之后需要完整发布快照
+        try:
+            data_version = self.cursor.execute('''
+            SELECT MAX(created_at) FROM table_metadata WHERE table_name IN ('iptv_playlists', 'filtered_playlists')
+            ''').fetchone()[0]
+        except sqlite3.OperationalError:
+            data_version = None
+        if data_version != self.data_version:
+            if self.data_version is not None:
+                logger.info("Sources were changed by another task, republishing the full snapshot.")
+                self.full_publish = True
+            self.data_version = data_version
+
+    def pace(self):
+        """两次测速发起之间的间隔（秒）"""
+        return MONITOR_INTERVAL_MINUTES * 60 / max(1, self.due_soon)
+
+    def publish(self):
+        """写入累积的结果，把变化的直播源同步到快照并重新导出播放列表"""
+        self.writer.flush()
+        if not self.changed_ids and not self.full_publish:
+            return
+        changed_ids, self.changed_ids = self.changed_ids, set()
         try:
-            value = float(cell)
-            if cell <= 400:
-                return 'background-color: #FF1493'
-            elif cell < 600:
-                return 'background-color: #FFFF00'
-            elif cell < 800:
-                return 'background-color: #90EE90'
+            if self.full_publish:
+                publish_snapshot(DB_PATH, NEW_DB_PATH)
+                self.full_publish = False
             else:
-                return 'background-color: #008000'
-        except ValueError:
-            return ''
+                refresh_snapshot(DB_PATH, NEW_DB_PATH, changed_ids)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Error refreshing snapshot {NEW_DB_PATH}: {e}")
+            self.changed_ids.update(changed_ids)  # 下次发布时重试
+            return
+
+        export_source_playlist(self.conn, 'data/filtered_sources.m3u8')
+        snapshot_conn = sqlite3.connect(f'file:{NEW_DB_PATH}?mode=ro', uri=True)
+        try:
+            generate_m3u8_file(snapshot_conn)
+        finally:
+            snapshot_conn.close()
 
-    df_style = df.style.map(highlight_speed, subset=['download_speed'])
-    df_style.to_excel('data/filtered_sources.xlsx', index=False)
+    async def probe(self, session, limiter, source):
+        host = host_of(source["url"])
+        semaphore = self.host_semaphores.setdefault(host, asyncio.BoundedSemaphore(MONITOR_LIMIT_PER_HOST))
+        try:
+            async with semaphore, limiter:
+                result = await test_stream(source, session)
+        except Exception as e:
+            logger.error(f"Unexpected error testing stream {source['url']}: {e}")
+            result = None
+        finally:
+            self.in_flight.discard(source["id"])
 
-    with open('data/filtered_sources.m3u8', 'w', encoding='utf-8') as f:
-        for _, row in df.iterrows():
-            f.write(f'#EXTINF:-1,{row["title"]}\n')
-            f.write(f'{row["url"]}\n')
+        self.writer.add(source, result)
+        if source["id"] in self.sources:
+            self.push(source["id"], next_due_time(source, self.demand, MONITOR_INTERVAL_MINUTES, max_interval_minutes()))
 
-    logger.info("Testing completed, results saved, and files generated.")
-    
-    generate_m3u8_file()
+    async def wait(self, seconds):
+        """等待 seconds 秒，收到停止信号时提前返回"""
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), max(0, seconds))
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop_event.set)
+            except (NotImplementedError, AttributeError):
+                pass  # Windows 不支持，依赖 KeyboardInterrupt
+
+        connector = aiohttp.TCPConnector(limit=MAX_THREADS, limit_per_host=MONITOR_LIMIT_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL)
+        limiter = AsyncAdaptiveLimiter(concurrency)
+        tasks = set()
+        next_refresh = next_publish = next_reset = next_downsample = next_dispatch = 0
+
+        async with aiohttp.ClientSession(connector=connector) as session:
+            try:
+                while not self.stop_event.is_set():
+                    now = time.time()
+                    if now >= next_refresh:
+                        self.refresh()
+                        next_refresh = now + DAEMON_REFRESH_SECONDS
+                    if now >= next_publish:
+                        self.publish()
+                        next_publish = now + DAEMON_PUBLISH_SECONDS
+                    if now >= next_reset:
+                        # 熔断只在一个周期内有效，下个周期重新尝试这些主机
+                        host_health.reset()
+                        next_reset = now + MONITOR_INTERVAL_MINUTES * 60
+                        logger.info(f"Rolling monitor: {len(self.sources)} sources, {self.due_soon} due in this interval, one probe every {self.pace():.2f} s.")
+                    if now >= next_downsample:
+                        downsample_measurements(self.conn, MEASUREMENT_RAW_DAYS, MEASUREMENT_RETENTION_DAYS)
+                        next_downsample = now + 86400
+
+                    # 跳过已删除或已重新安排的直播源留下的堆元素
+                    while self.queue and self.due_at.get(self.queue[0][1]) != self.queue[0][0]:
+                        heapq.heappop(self.queue)
+
+                    if not self.queue or max(self.queue[0][0], next_dispatch) > now:
+                        wake_at = min(next_refresh, next_publish, next_reset, next_downsample, max(self.queue[0][0], next_dispatch) if self.queue else next_refresh)
+                        await self.wait(wake_at - now)
+                        continue
+
+                    _, source_id = heapq.heappop(self.queue)
+                    del self.due_at[source_id]
+                    self.in_flight.add(source_id)
+                    task = asyncio.create_task(self.probe(session, limiter, self.sources[source_id]))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    next_dispatch = now + self.pace()
+            finally:
+                logger.info(f"Stopping rolling monitor, waiting up to {DAEMON_SHUTDOWN_SECONDS} s for {len(tasks)} probes in progress.")
+                if tasks:
+                    # 完成的检测结果在最后一次发布时写入，超时仍未完成的才取消
+                    _, pending = await asyncio.wait(list(tasks), timeout=DAEMON_SHUTDOWN_SECONDS)
+                    if pending:
+                        logger.warning(f"Cancelling {len(pending)} probes still in progress.")
+                        for task in pending:
+                            task.cancel()
+                        await asyncio.gather(*pending, return_exceptions=True)
+                self.publish()
+                concurrency.log_summary()
+
+def run_daemon():
+    conn = sqlite3.connect(DB_PATH, timeout=30)  # 与其他检测脚本共用数据库，等待它们的写事务
+    try:
+        asyncio.run(RollingMonitor(conn).run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+    logger.info("Rolling monitor stopped.")
 
-def generate_m3u8_file():
+def generate_m3u8_file(conn):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query("""
-        SELECT * FROM filtered_playlists_readonly
-        WHERE download_speed > 0
-        AND latency IS NOT NULL
-        ORDER BY tvordero ASC
-        """, conn)
-
-        m3u8_path = 'data/aggregated_channels.m3u8'
-
-        with open(m3u8_path, 'w', encoding='utf-8') as m3u8_file:
-            m3u8_file.write("#EXTM3U\n")
-            unique_channels = set()
-
-            for _, row in df.iterrows():
-                aliasesname = row['aliasesname']
-                if aliasesname not in unique_channels:
-                    m3u8_file.write(f"#EXTINF:-1 tvg-name=\"{row['tvg_name']}\" group-title=\"{row['group_title']}\",{row['title']}\n")
-                    m3u8_file.write(f"http://{HOST_IP}:{PORT}/{row['aliasesname']}\n")
-                    unique_channels.add(aliasesname)
-                    logger.info(f"Added channel to M3U8: {row['title']} with URL path /{row['aliasesname']}")
-        logger.info(f"Generated {m3u8_path} file successfully.")
+        export_aggregated_playlist(conn, 'data/aggregated_channels.m3u8', HOST_IP, PORT)
     except sqlite3.DatabaseError as db_err:
         logger.error(f"Database error while generating M3U8 file: {db_err}")
     except Exception as e:
         logger.error(f"Error generating M3U8 file: {e}")
-    finally:
-        conn.close()
 
 def copy_table_to_new_db():
+    """把 filtered_playlists 发布为重定向服务器读取的只读快照，发布失败时保留旧快照"""
     try:
-        # 连接到现有数据库和新数据库
-        source_conn = sqlite3.connect(DB_PATH)
-        dest_conn = sqlite3.connect(NEW_DB_PATH)
-
-        source_cursor = source_conn.cursor()
-        dest_cursor = dest_conn.cursor()
-
-        # 检查目标数据库中的 filtered_playlists_readonly 表是否存在
-        dest_cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='filtered_playlists_readonly'")
-        table_exists = dest_cursor.fetchone()
-
-        if table_exists:
-            logger.info("表 filtered_playlists_readonly 已存在，正在清空表内容...")
-            dest_cursor.execute("DELETE FROM filtered_playlists_readonly")
-            dest_conn.commit()
-        else:
-            # 如果表不存在，先在目标数据库中创建它
-            logger.info("表 filtered_playlists_readonly 不存在，创建新表...")
-            dest_cursor.execute('''
-                CREATE TABLE filtered_playlists_readonly (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tvg_id TEXT,
-                    tvg_name TEXT,
-                    group_title TEXT,
-                    aliasesname TEXT,
-                    tvordero INTEGER,
-                    tvg_logor TEXT,
-                    title TEXT,
-                    url TEXT,
-                    latency INTEGER,
-                    resolution TEXT,
-                    format TEXT,
-                    download_speed FLOAT,
-                    score FLOAT,
-                    failure_count INTEGER DEFAULT 0,
-                    last_failed_date TIMESTAMP DEFAULT 0
-                )
-            ''')
-            dest_conn.commit()
-
-        # 从源数据库复制表的内容到目标数据库
-        logger.info("开始将 filtered_playlists 表内容复制到 filtered_playlists_readonly...")
-        source_cursor.execute("SELECT * FROM filtered_playlists")
-        rows = source_cursor.fetchall()
-
-        if rows:
-            # 获取源表的列数，并使用占位符插入多列数据
-            columns = [description[0] for description in source_cursor.description]
-            placeholders = ', '.join(['?'] * len(columns))  # 为每个列生成占位符
-
-            # 使用 executemany 插入多行数据
-            dest_cursor.executemany(f"""
-                INSERT INTO filtered_playlists_readonly ({', '.join(columns)}) 
-                VALUES ({placeholders})
-            """, rows)
-            dest_conn.commit()
-
-        logger.info("成功将 filtered_playlists_readonly 复制到新的数据库文件 filtered_sources_readonly.db")
-
-    except sqlite3.Error as e:
-        logger.error(f"Error copying filtered_playlists_readonly to new database: {e}")
-    finally:
-        source_conn.close()
-        dest_conn.close()
+        publish_snapshot(DB_PATH, NEW_DB_PATH)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Error publishing snapshot {NEW_DB_PATH}: {e}")
 
 if __name__ == "__main__":
-    run_tests()
+    parser = argparse.ArgumentParser(description="直播源延迟和下载速度检测")
+    parser.add_argument('--daemon', action='store_true', help="常驻运行，在测速周期内均匀地逐个检测直播源")
+    args = parser.parse_args()
+    if args.daemon:
+        run_daemon()
+    else:
+        run_tests()
     logger.info("Finished daily_monitor.py.")
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import pandas as pd
+from logging_config import logger  # 使用外部的日志配置
+
+report_lock = threading.Lock()  # 同一进程中同时只生成一次报表
+
+def highlight_speed(cell):
+    # 按下载速度给单元格着色
+    try:
+        value = float(cell)
+        if value <= 400:
+            return 'background-color: #FF1493'
+        elif value < 600:
+            return 'background-color: #FFFF00'
+        elif value < 800:
+            return 'background-color: #90EE90'
+        else:
+            return 'background-color: #008000'
+    except ValueError:
+        return ''
+
+def write_excel_report(db_path, table, report_path):
+    """把 table 导出为按下载速度着色的 Excel 报表"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        df = pd.read_sql_query(f"SELECT * FROM {table} ORDER BY id", conn)
+    finally:
+        conn.close()
+
+    df['download_speed'] = pd.to_numeric(df['download_speed'], errors='coerce').fillna(0)
+    # 临时文件与报表放在同一目录，名称唯一，多个进程同时导出时互不覆盖，写完后原子替换
+    fd, temp_path = tempfile.mkstemp(suffix='.xlsx', prefix='.report-', dir=os.path.dirname(os.path.abspath(report_path)))
+    os.close(fd)
+    try:
+        df.style.map(highlight_speed, subset=['download_speed']).to_excel(temp_path, index=False)
+        os.replace(temp_path, report_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    logger.info(f"Generated Excel report {report_path} with {len(df)} sources.")
+
+def ensure_report(db_path, table, report_path):
+    """报表不存在或早于数据库时重新生成，用于按需下载报表
+
+    并发请求在锁上等待，第一个请求生成后其余请求直接使用新报表。
+    """
+    with report_lock:
+        if not os.path.exists(report_path) or os.path.getmtime(report_path) < os.path.getmtime(db_path):
+            write_excel_report(db_path, table, report_path)
+    return report_path
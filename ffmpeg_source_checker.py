@@ -1,12 +1,17 @@
 from logging_config import logger  # 引入日志配置
 import sqlite3
 import json
-import subprocess
-import concurrent.futures
-import threading
 import asyncio
 import aiohttp
-from calculate_score import calculate_score  # 导入 calculate_score 函数
+from calculate_score import calculate_scores  # 批量评分
+from process_runner import run_process  # 异步子进程运行器
+from probe_cache import ProbeCache, build_fingerprint  # ffprobe 结果缓存
+from host_health import HostHealth, CONNECT_ERRORS, host_of, group_by_host  # 主机级熔断
+from result_writer import BatchWriter, stage_ids  # 批量写入检测结果
+from run_journal import start_run, journal_batch, finish_run  # 可恢复的检测轮次
+from ts_parser import parse_ts_video_info  # 进程内解析 TS 头部
+from hls_playlist import is_playlist, parse_playlist, choose_variant, looks_like_hls, check_hls  # HLS 播放列表解析与检测
+from adaptive_concurrency import AIMDController, AsyncAdaptiveLimiter  # 自适应并发控制
 import os
 
 logger.info("开始执行 分辨率检测 任务")
@@ -47,62 +52,159 @@ LATENCY_LIMIT = int(os.getenv('LATENCY_LIMIT', config['source_checker']['latency
 CODEC_EXCLUDE_LIST = os.getenv('CODEC_EXCLUDE_LIST', ','.join(config['source_checker']['codec_exclude_list'])).split(',')
 RETRY_LIMIT = int(os.getenv('RETRY_LIMIT', config['source_checker']['retry_limit']))  # 重试次数
 FAILURE_THRESHOLD = int(os.getenv('FAILURE_THRESHOLD', config['source_checker']['failure_threshold']))  # 最大失败次数阈值
+CHANNEL_TARGET_SOURCES = int(os.getenv('CHANNEL_TARGET_SOURCES', config['source_checker'].get('channel_target_sources', 0)))  # 每个频道验证到多少个可用源后停止检测，0 表示检测全部
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', config['source_checker'].get('write_batch_size', 500)))  # 每个事务写入的检测结果数
+LIMIT_PER_HOST = int(os.getenv('LIMIT_PER_HOST', config['source_checker'].get('limit_per_host', 4)))  # 单个主机同时检测的最大直播源数
+HOST_FAILURE_THRESHOLD = int(os.getenv('HOST_FAILURE_THRESHOLD', config['source_checker'].get('host_failure_threshold', 3)))  # 主机连续连接失败次数阈值，0 表示不熔断
+DNS_CACHE_TTL = 300  # 连接池 DNS 缓存时间（秒）
+
+# ffprobe 并发数单独限制，默认与 CPU 核心数相同，最小为1
+FFPROBE_LIMIT = int(os.getenv('FFPROBE_LIMIT', config['source_checker'].get('ffprobe_limit', 0)))
+if FFPROBE_LIMIT == 0:
+    FFPROBE_LIMIT = max(1, os.cpu_count())
+PROBE_SIZE = int(os.getenv('PROBE_SIZE', config['source_checker'].get('probesize', 2000000)))  # ffprobe 读取的最大字节数
+ANALYZE_DURATION = int(os.getenv('ANALYZE_DURATION', config['source_checker'].get('analyzeduration', 2000000)))  # ffprobe 分析时长（微秒）
+FAST_PROBE = str(os.getenv('FAST_PROBE', config['source_checker'].get('fast_probe', True))).lower() in ('1', 'true', 'yes')  # 是否先在进程内解析 TS 头部
+FAST_PROBE_BYTES = int(os.getenv('FAST_PROBE_BYTES', config['source_checker'].get('fast_probe_bytes', 1048576)))  # 进程内解析最多读取的字节数
+FAST_PROBE_PARSE_STEP = 64 * 1024  # 每读取这么多字节尝试解析一次
+HLS_CHECK = str(os.getenv('HLS_CHECK', config['source_checker'].get('hls_check', True))).lower() in ('1', 'true', 'yes')  # HLS 源是否检测播放列表新鲜度和最新切片
+PROBE_CACHE_TTL_MINUTES = int(os.getenv('PROBE_CACHE_TTL_MINUTES', config['source_checker'].get('probe_cache_ttl_minutes', 720)))  # 检测结果缓存有效期，0 表示不使用缓存
+
+# 自适应并发：THREAD_LIMIT 作为初始并发数，运行中在 1 到 MAX_THREAD_LIMIT 之间调整
+ADAPTIVE_CONCURRENCY = str(os.getenv('ADAPTIVE_CONCURRENCY', config['source_checker'].get('adaptive_concurrency', True))).lower() in ('1', 'true', 'yes')
+MAX_THREAD_LIMIT = int(os.getenv('MAX_THREAD_LIMIT', config['source_checker'].get('max_thread_limit', 0)))  # 0 表示 THREAD_LIMIT 的 4 倍
+if MAX_THREAD_LIMIT == 0:
+    MAX_THREAD_LIMIT = THREAD_LIMIT * 4
+if not ADAPTIVE_CONCURRENCY:
+    MAX_THREAD_LIMIT = THREAD_LIMIT
+CPU_LIMIT_PERCENT = int(os.getenv('CPU_LIMIT_PERCENT', config['source_checker'].get('cpu_limit_percent', 90)))  # CPU 使用率达到该值时减少并发
+
+concurrency = AIMDController('ffmpeg_source_checker', THREAD_LIMIT, MAX_THREAD_LIMIT, CPU_LIMIT_PERCENT)
+
+# HTTP HEAD 请求检测流是否可用，复用共享连接池，返回 (是否可用, 上游指纹, HLS 检测信息)
+# HLS 源在 HEAD 成功后还会检测媒体播放列表是否在更新、最新切片能否下载
+async def check_http_head(session, url, host_health):
+    timeout = aiohttp.ClientTimeout(total=LATENCY_LIMIT)
+    try:
+        async with session.head(url, timeout=timeout) as response:
+            host_health.record_success(host_of(url))
+            if response.status != 200:
+                logger.warning(f"Stream not available, status: {response.status} for URL: {url}")
+                return False, None, None
+            fingerprint = build_fingerprint(url, response.headers)
+            content_type = response.headers.get('Content-Type', '')
+
+        if HLS_CHECK and looks_like_hls(url, content_type):
+            hls = await check_hls(session, url, timeout)
+            if not hls["ok"]:
+                logger.warning(f"HLS stream rejected: {hls['reason']} for URL: {url}")
+                return False, None, hls
+            logger.info(f"HLS stream is available: {url} | Target duration: {hls['target_duration']} | Playlist age: {hls['age']}")
+            return True, fingerprint, hls
+
+        logger.info(f"Stream is available: {url}")
+        return True, fingerprint, None
+    except CONNECT_ERRORS as e:
+        host_health.record_failure(host_of(url))
+        if isinstance(e, asyncio.TimeoutError):
+            concurrency.record_timeout()  # HEAD 和 HLS 检测超时同样计入自适应并发的超时率
+        logger.error(f"HTTP HEAD request failed for {url}: {e}")
+        return False, None, None
+    except Exception as e:
+        logger.error(f"HTTP HEAD request failed for {url}: {e}")
+        return False, None, None
 
-lock = threading.Lock()
-
-# HTTP HEAD 请求检测流是否可用
-async def check_http_head(url):
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.head(url, timeout=LATENCY_LIMIT) as response:
-                if response.status == 200:
-                    logger.info(f"Stream is available: {url}")
-                    return True
-                else:
-                    logger.warning(f"Stream not available, status: {response.status} for URL: {url}")
-                    return False
-        except Exception as e:
-            logger.error(f"HTTP HEAD request failed for {url}: {e}")
-            return False
-
-# 用 ffprobe 检测分辨率和格式
-def get_video_info(url):
+# 用 ffprobe 检测分辨率和格式，并发数由 ffprobe_semaphore 限制
+async def get_video_info(url, ffprobe_semaphore):
     command = [
-        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        'ffprobe', '-v', 'error',
+        '-probesize', str(PROBE_SIZE),
+        '-analyzeduration', str(ANALYZE_DURATION),
+        '-select_streams', 'v:0',
         '-show_entries', 'stream=width,height,codec_name',
         '-of', 'json', url
     ]
-    
+
     try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=LATENCY_LIMIT)
-        info = json.loads(result.stdout)
+        async with ffprobe_semaphore:
+            _, stdout, _ = await run_process(command, timeout=LATENCY_LIMIT)
+        info = json.loads(stdout.decode('utf-8', errors='ignore'))
         if 'streams' in info and len(info['streams']) > 0:
-            width = info['streams'][0].get('width', 'Unknown')
             height = info['streams'][0].get('height', 'Unknown')
             codec_name = info['streams'][0].get('codec_name', 'Unknown')
             return int(height) if height != 'Unknown' else "Unknown", codec_name
         return "Unknown", "Unknown"
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
+        concurrency.record_timeout()
         logger.error(f"Timeout occurred for {url}")
         return "Unknown", "Unknown"
     except Exception as e:
         logger.error(f"Error getting video info for {url}: {e}")
         return "Unknown", "Unknown"
 
-# 检测流信息的主函数
-import asyncio
+# 读取流开头的数据，边读边尝试解析 TS 头部，返回 (读取的数据, (height, codec) 或 None)
+async def read_ts_header(session, url, timeout):
+    buffer = bytearray()
+    async with session.get(url, timeout=timeout) as response:
+        if response.status not in (200, 206):
+            return bytes(buffer), None
+        parsed_length = 0
+        while len(buffer) < FAST_PROBE_BYTES:
+            chunk = await response.content.read(FAST_PROBE_PARSE_STEP)
+            if not chunk:
+                break
+            buffer.extend(chunk)
+            if is_playlist(buffer[:64]):
+                continue  # 播放列表需要完整读取
+            if len(buffer) - parsed_length >= FAST_PROBE_PARSE_STEP:
+                parsed_length = len(buffer)
+                info = parse_ts_video_info(buffer)
+                if info:
+                    return bytes(buffer), info
+    return bytes(buffer), parse_ts_video_info(buffer) if len(buffer) > parsed_length else None
+
+# 不启动 ffprobe，直接解析 TS 流或 HLS 切片的头部获取分辨率和格式，失败时返回 None
+# 已做过 HLS 检测时直接读取检测到的最新切片
+async def get_header_video_info(session, url, hls=None):
+    timeout = aiohttp.ClientTimeout(total=LATENCY_LIMIT)
+    try:
+        if hls and hls["newest_segment"]:
+            _, info = await read_ts_header(session, hls["newest_segment"], timeout)
+            return info
+
+        data, info = await read_ts_header(session, url, timeout)
+        if info or not is_playlist(data):
+            return info
+
+        playlist = parse_playlist(data.decode('utf-8', errors='ignore'), url)
+        if playlist["is_master"]:
+            variant = choose_variant(playlist["variants"])
+            async with session.get(variant["uri"], timeout=timeout) as response:
+                playlist = parse_playlist(await response.text(errors='ignore'), variant["uri"])
+        if not playlist["segments"]:
+            return None
+
+        # 直播播放列表最前面的切片最早过期，与 check_hls 一样读取最新的切片
+        _, info = await read_ts_header(session, playlist["segments"][-1]["uri"], timeout)
+        return info
+    except Exception as e:
+        logger.warning(f"Fast header probe failed for {url}: {e}")
+        return None
 
 # 检测流信息的主函数
-def test_stream(source, cursor, conn):
+async def test_stream(source, session, ffprobe_semaphore, probe_cache, host_health):
     url = source["url"]
     retry_count = 0
 
-    # 创建并设置新的事件循环，适用于多线程环境
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    # 主机已熔断时直接判定失败，不再等待超时
+    if host_health.is_tripped(host_of(url)):
+        logger.info(f"Skipping {url} because its host is unreachable in this run")
+        return None
 
-    # 使用异步方式进行 HTTP HEAD 检测
-    available = loop.run_until_complete(check_http_head(url))
+    # 使用共享连接池进行 HTTP HEAD 检测
+    available, fingerprint, hls = await check_http_head(session, url, host_health)
+    if hls:
+        probe_cache.put_hls(url, hls)
 
     if not available:
         logger.info(f"Skipping further checks for {url} due to failed HTTP HEAD")
@@ -110,17 +212,24 @@ def test_stream(source, cursor, conn):
 
     while retry_count <= RETRY_LIMIT:
         try:
-            # 获取分辨率和格式
-            resolution, format = get_video_info(url)
+            # 获取分辨率和格式，缓存有效且上游未变化时跳过 ffprobe
+            cached = probe_cache.get(url, fingerprint)
+            if cached:
+                resolution, format = cached
+                logger.info(f"Using cached probe result for {url}")
+            else:
+                # 优先在进程内解析头部，解析失败时再启动 ffprobe
+                info = await get_header_video_info(session, url, hls) if FAST_PROBE else None
+                if info:
+                    resolution, format = info
+                    logger.info(f"Parsed stream header in process for {url}")
+                else:
+                    resolution, format = await get_video_info(url, ffprobe_semaphore)
+                probe_cache.put(url, resolution, format, fingerprint)
 
-            # 稳定性、成功率、延迟、下载速度的默认值
-            stability = 1
-            success_rate = 1
+            # 延迟、下载速度的默认值，评分在批量写入时统一计算
             latency = 0
             download_speed = 0.0
-            
-            # 计算分数
-            score = round(calculate_score(resolution, format, latency, download_speed, stability, success_rate), 4)
 
             # 检查分辨率限制
             if HEIGHT_LIMIT is not None:
@@ -137,7 +246,7 @@ def test_stream(source, cursor, conn):
                 logger.info(f"Excluding source with format {format}: {url}")
                 return None
 
-            logger.info(f"Stream OK: {url} | Resolution: {resolution} | Format: {format} | Score: {score}")
+            logger.info(f"Stream OK: {url} | Resolution: {resolution} | Format: {format}")
             return {
                 "url": url,
                 "resolution": resolution,
@@ -152,19 +261,9 @@ def test_stream(source, cursor, conn):
                 "id": source["id"],
                 "latency": latency,
                 "download_speed": download_speed,
-                "score": score
+                "score": None
             }
 
-        except subprocess.TimeoutExpired:
-            logger.error(f"Timeout occurred for {url}")
-            cursor.execute('''
-                UPDATE iptv_playlists
-                SET failure_count = failure_count + 1, last_failed_date = datetime('now', 'localtime')
-                WHERE id = ?
-            ''', (source['id'],))
-            conn.commit()  # 确保 conn 在此处被传递
-            return None  # 在超时时立即返回，跳过后续的分辨率检查
-
         except Exception as e:
             retry_count += 1
             logger.error(f"Error testing stream {url}: {e}, retrying {retry_count}/{RETRY_LIMIT}...")
@@ -172,6 +271,142 @@ def test_stream(source, cursor, conn):
     logger.error(f"Failed to test stream {url} after {RETRY_LIMIT} attempts.")
     return None
 
+def order_by_channel(sources, healthy_urls):
+    """按频道排列直播源：没有可用源的频道优先，同一频道内失败次数少、曾检测成功的直播源优先"""
+    return sorted(sources, key=lambda source: (
+        len(healthy_urls.get(source["aliasesname"], ())),
+        source["aliasesname"] or '',
+        source["failure_count"] or 0,
+        source["resolution"] is None
+    ))
+
+async def probe_sources(sources, probe_cache, on_result, healthy_urls=None):
+    """在单个事件循环中并发检测所有直播源，共享一个带主机连接上限的连接池
+
+    同时进行的检测数由自适应控制器在 THREAD_LIMIT 的基础上调整，FFPROBE_LIMIT 单独限制同时运行的 ffprobe 进程数，
+    LIMIT_PER_HOST 限制同一主机同时检测的直播源数。直播源按主机分组排列，
+    同一主机连续连接失败后其余直播源直接跳过。
+
+    传入 healthy_urls（频道已有的可用 URL 集合）时按频道调度，同一频道同时最多检测
+    CHANNEL_TARGET_SOURCES 个直播源，频道不同 URL 的可用源达到 CHANNEL_TARGET_SOURCES 后
+    跳过该频道剩余的直播源，跳过的直播源不计为失败。
+    """
+    connector = aiohttp.TCPConnector(limit=MAX_THREAD_LIMIT, limit_per_host=LIMIT_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL)
+    limiter = AsyncAdaptiveLimiter(concurrency)
+    ffprobe_semaphore = asyncio.BoundedSemaphore(FFPROBE_LIMIT)
+    host_health = HostHealth(HOST_FAILURE_THRESHOLD)
+    groups = group_by_host(sources)
+    host_semaphores = {host: asyncio.BoundedSemaphore(LIMIT_PER_HOST) for host in groups}
+
+    if healthy_urls is None:
+        ordered = [source for group in groups.values() for source in group]
+        channel_semaphores = {}
+    else:
+        ordered = order_by_channel(sources, healthy_urls)
+        channel_semaphores = {source["aliasesname"]: asyncio.BoundedSemaphore(CHANNEL_TARGET_SOURCES) for source in sources}
+    skipped = 0
+
+    def channel_satisfied(source):
+        return healthy_urls is not None and len(healthy_urls.get(source["aliasesname"], ())) >= CHANNEL_TARGET_SOURCES
+
+    async def probe(source, session):
+        # 先占用主机名额再占用全局名额，等待繁忙主机时不占用全局并发
+        # 等待每个名额期间频道都可能已经达到目标源数，占用后各检查一次，跳过的源不发起检测
+        async with host_semaphores[host_of(source["url"])]:
+            if channel_satisfied(source):
+                return source, None, True
+            async with limiter:
+                if channel_satisfied(source):
+                    return source, None, True
+                try:
+                    result = await test_stream(source, session, ffprobe_semaphore, probe_cache, host_health)
+                except Exception as e:
+                    logger.error(f"Unexpected error testing stream {source['url']}: {e}")
+                    return source, None, False
+                if result and healthy_urls is not None:
+                    # 释放频道名额前记录，等待同一频道的检测立即看到新的可用源
+                    healthy_urls.setdefault(source["aliasesname"], set()).add(source["url"])
+                return source, result, False
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def bounded_test(source):
+            channel_semaphore = channel_semaphores.get(source["aliasesname"])
+            if channel_semaphore is None:
+                return await probe(source, session)
+            # 同一频道同时进行的检测不超过目标源数，其余直播源等前面的检测有结果后再决定是否检测
+            async with channel_semaphore:
+                if channel_satisfied(source):
+                    return source, None, True
+                return await probe(source, session)
+
+        tasks = [asyncio.create_task(bounded_test(source)) for source in ordered]
+        for task in asyncio.as_completed(tasks):
+            source, result, is_skipped = await task
+            if is_skipped:
+                skipped += 1
+                continue
+            on_result(source, result)
+
+    logger.info(f"Probed {len(sources) - skipped} sources on {len(groups)} hosts, {host_health.summary()} hosts short-circuited, {skipped} skipped for channels with enough sources.")
+    concurrency.log_summary()
+
+def score_results(successes):
+    """一次计算一批检测结果的评分，分辨率检测阶段的稳定性和成功率按 1 计算"""
+    if not successes:
+        return
+    scores = calculate_scores(
+        [result["resolution"] for result in successes],
+        [result["format"] for result in successes],
+        [result["latency"] for result in successes],
+        [result["download_speed"] for result in successes],
+        stability=1,
+        success_rate=1
+    )
+    for result, score in zip(successes, scores):
+        result["score"] = float(score)
+
+def save_results(cursor, successes, failures):
+    """在一个事务中批量写入一批检测结果，失败阈值的处理使用基于集合的 SQL"""
+    score_results(successes)
+    successes.sort(key=lambda x: x["tvordero"])
+
+    # 已存在于 filtered_playlists 的 URL 视为重复，不更新也不插入
+    cursor.executemany('''
+        UPDATE iptv_playlists
+        SET resolution = ?, format = ?, failure_count = 0, last_failed_date = NULL
+        WHERE id = ? AND NOT EXISTS (SELECT 1 FROM filtered_playlists WHERE url = iptv_playlists.url)
+    ''', [(result["resolution"], result["format"], result["id"]) for result in successes])
+
+    cursor.executemany('''
+        INSERT INTO filtered_playlists (tvg_id, tvg_name, group_title, aliasesname, tvordero, tvg_logor, title, url, latency, resolution, format, download_speed, score)
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM filtered_playlists WHERE url = ?)
+    ''', [(result["tvg_id"], result["tvg_name"], result["group_title"], result["aliasesname"], result["tvordero"], result["tvg_logor"], result["title"], result["url"], result["latency"], result["resolution"], result["format"], result["download_speed"], result["score"], result["url"]) for result in successes])
+
+    if not failures:
+        return
+
+    cursor.executemany('''
+    UPDATE iptv_playlists
+    SET failure_count = failure_count + 1, last_failed_date = datetime('now', 'localtime')
+    WHERE id = ?
+    ''', [(source["id"],) for source in failures])
+
+    # 达到失败阈值的直播源整体移入 failed_sources
+    stage_ids(cursor, [source["id"] for source in failures])
+    cursor.execute('''
+    INSERT INTO failed_sources (tvg_id, tvg_name, group_title, aliasesname, tvordero, tvg_logor, title, url, failure_count, last_failed_date)
+    SELECT tvg_id, tvg_name, group_title, aliasesname, tvordero, tvg_logor, title, url, failure_count, last_failed_date
+    FROM iptv_playlists
+    WHERE id IN (SELECT id FROM batch_ids) AND failure_count >= ?
+    ''', (FAILURE_THRESHOLD,))
+    cursor.execute('''
+    DELETE FROM iptv_playlists
+    WHERE id IN (SELECT id FROM batch_ids) AND failure_count >= ?
+    ''', (FAILURE_THRESHOLD,))
+    if cursor.rowcount > 0:
+        logger.info(f"{cursor.rowcount} sources moved to failed_sources due to exceeding failure threshold.")
+
 def run_tests():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
@@ -219,84 +454,67 @@ def run_tests():
     )
     ''')
 
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_filtered_playlists_url ON filtered_playlists (url)')
+
     cursor.execute('''
     INSERT OR REPLACE INTO table_metadata (table_name, created_at)
     VALUES ('filtered_playlists', datetime('now', 'localtime'))
     ''')
 
     cursor.execute('''
-    SELECT id, tvg_id, tvg_name, group_title, aliasesname, tvordero, tvg_logor, title, url, failure_count
+    SELECT id, tvg_id, tvg_name, group_title, aliasesname, tvordero, tvg_logor, title, url, failure_count, resolution
     FROM iptv_playlists
     WHERE last_failed_date IS NOT NULL
     ''')
     sources = cursor.fetchall()
 
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_LIMIT) as executor:
-        future_to_url = {executor.submit(test_stream, {
-            "id": source[0],
-            "tvg_id": source[1],
-            "tvg_name": source[2],
-            "group_title": source[3],
-            "aliasesname": source[4],
-            "tvordero": source[5],
-            "tvg_logor": source[6],
-            "title": source[7],
-            "url": source[8],
-            "failure_count": source[9]
-        }, cursor, conn): source for source in sources}
-
-        for future in concurrent.futures.as_completed(future_to_url):
-            result = future.result()
-            if result:
-                cursor.execute('''
-                    SELECT 1 FROM filtered_playlists WHERE url = ?
-                ''', (result['url'],))
-                exists = cursor.fetchone()
-
-                if not exists:
-                    results.append(result)
-                else:
-                    logger.info(f"Skipping duplicate URL: {result['url']}")
-            else:
-                source_id = future_to_url[future][0]
-                cursor.execute('''
-                UPDATE iptv_playlists
-                SET failure_count = failure_count + 1, last_failed_date = datetime('now', 'localtime')
-                WHERE id = ?
-                ''', (source_id,))
-
-                cursor.execute('SELECT failure_count FROM iptv_playlists WHERE id = ?', (source_id,))
-                failure_count = cursor.fetchone()[0]
-
-                if failure_count >= FAILURE_THRESHOLD:
-                    cursor.execute('''
-                    INSERT INTO failed_sources (tvg_id, tvg_name, group_title, aliasesname, tvordero, tvg_logor, title, url, failure_count, last_failed_date)
-                    SELECT tvg_id, tvg_name, group_title, aliasesname, tvordero, tvg_logor, title, url, failure_count, last_failed_date
-                    FROM iptv_playlists
-                    WHERE id = ?
-                    ''', (source_id,))
-                    cursor.execute('DELETE FROM iptv_playlists WHERE id = ?', (source_id,))
-                    logger.info(f"Source {source_id} moved to failed_sources due to exceeding failure threshold.")
-
-    results.sort(key=lambda x: x["tvordero"])
-
-    for result in results:
-        cursor.execute('''
-            UPDATE iptv_playlists
-            SET resolution = ?, format = ?, failure_count = 0, last_failed_date = NULL
-            WHERE id = ?
-        ''', (result["resolution"], result["format"], result["id"]))
+    probe_cache = ProbeCache(cursor, PROBE_CACHE_TTL_MINUTES)
+    conn.commit()
+
+    # 上一轮被中断时跳过已经处理过的直播源
+    run_id, done_ids, _ = start_run(conn, 'ffmpeg_source_checker')
+    sources = [source for source in sources if source[0] not in done_ids]
 
+    # 按频道调度时收集每个频道已有的可用 URL，同一频道重复的 URL 只算一个可用源
+    healthy_urls = None
+    if CHANNEL_TARGET_SOURCES > 0:
+        # 只统计与频道索引相同条件下可用的源，下载速度为 0 或没有延迟的行不算
         cursor.execute('''
-            INSERT INTO filtered_playlists (tvg_id, tvg_name, group_title, aliasesname, tvordero, tvg_logor, title, url, latency, resolution, format, download_speed, score)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (result["tvg_id"], result["tvg_name"], result["group_title"], result["aliasesname"], result["tvordero"], result["tvg_logor"], result["title"], result["url"], result["latency"], result["resolution"], result["format"], result["download_speed"], result["score"]))
+        SELECT DISTINCT aliasesname, url FROM filtered_playlists
+        WHERE download_speed > 0
+        AND latency IS NOT NULL
+        ''')
+        healthy_urls = {}
+        for aliasesname, url in cursor.fetchall():
+            healthy_urls.setdefault(aliasesname, set()).add(url)
+
+    def flush_batch(batch_cursor, successes, failures):
+        save_results(batch_cursor, successes, failures)
+        probe_cache.flush()
+        journal_batch(batch_cursor, run_id, successes, failures)
+
+    # 所有检测在同一个事件循环中完成，检测结果交给单一写入者批量写入数据库
+    writer = BatchWriter(conn, flush_batch, WRITE_BATCH_SIZE)
+    asyncio.run(probe_sources([{
+        "id": source[0],
+        "tvg_id": source[1],
+        "tvg_name": source[2],
+        "group_title": source[3],
+        "aliasesname": source[4],
+        "tvordero": source[5],
+        "tvg_logor": source[6],
+        "title": source[7],
+        "url": source[8],
+        "failure_count": source[9],
+        "resolution": source[10]
+    } for source in sources], probe_cache, writer.add, healthy_urls))
+    writer.close()
+    finish_run(conn, run_id)
 
     conn.commit()
     conn.close()
 
-    logger.info("Testing completed, results sorted by tvordero, and data saved.")
+    logger.info("Testing completed, results saved in batches.")
 
 if __name__ == "__main__":
     run_tests()
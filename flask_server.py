@@ -1,10 +1,16 @@
 from waitress import serve
-from flask import Flask, redirect, send_file
-import pandas as pd
+from urllib.parse import quote
+from flask import Flask, Response, redirect, request, send_file
 import os
-import sqlite3
 import json
 from logging_config import logger  # 使用项目中的日志配置
+from channel_demand import DemandCounter  # 频道访问计数
+from channel_index import ChannelIndex  # 内存频道索引
+from load_balancer import LoadBalancer  # 在多个直播源之间分配重定向
+from source_health import SourceHealth  # 直播源健康检查与降级
+from hls_relay import HlsRelay, is_relayable  # HLS 中继
+from ts_relay import TsRelay, has_ts_sources  # MPEG-TS 流中继
+from hls_playlist import looks_like_hls
 
 logger.info("启动 flask服务器")
 
@@ -29,48 +35,155 @@ def load_config():
 config = load_config()
 HOST_IP = os.getenv('HOST_IP', config["network"]["host_ip"])  # 读取 host_ip 配置
 PORT = int(os.getenv('PORT', int(config["network"]["port"])))
+DEMAND_FLUSH_SECONDS = int(os.getenv('DEMAND_FLUSH_SECONDS', config['scheduler'].get('demand_flush_seconds', 60)))  # 访问计数写入数据库的间隔（秒）
+REDIRECT_MODE = os.getenv('REDIRECT_MODE', config['network'].get('redirect_mode', 'top'))  # top 总是选评分最高的直播源，weighted 按权重随机，round_robin 按权重轮询
+REDIRECT_TOP_K = int(os.getenv('REDIRECT_TOP_K', config['network'].get('redirect_top_k', 3)))  # 参与分配的评分最高的直播源数
+REDIRECT_STICKY_SECONDS = int(os.getenv('REDIRECT_STICKY_SECONDS', config['network'].get('redirect_sticky_seconds', 0)))  # 同一客户端保持同一直播源的时间（秒），0 表示不保持
+HEALTH_CHECK = str(os.getenv('HEALTH_CHECK', config['network'].get('health_check', True))).lower() in ('1', 'true', 'yes')  # 重定向前检查直播源是否可用
+HEALTH_CHECK_TTL = int(os.getenv('HEALTH_CHECK_TTL', config['network'].get('health_check_ttl', 30)))  # 检查结果缓存时间（秒）
+HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', config['network'].get('health_check_timeout', 2)))  # 检查超时时间（秒）
+REREQUEST_SECONDS = int(os.getenv('REREQUEST_SECONDS', config['network'].get('rerequest_seconds', 5)))  # 同一客户端在该时间内重复请求同一频道视为播放失败
+REREQUEST_THRESHOLD = int(os.getenv('REREQUEST_THRESHOLD', config['network'].get('rerequest_threshold', 3)))  # 同一直播源累计多少次重复请求后重新检查或降级，0 表示不使用
+DEMOTE_SECONDS = int(os.getenv('DEMOTE_SECONDS', config['network'].get('demote_seconds', 300)))  # 失效直播源的降级时间（秒）
+RELAY_HLS = str(os.getenv('RELAY_HLS', config['network'].get('relay_hls', False))).lower() in ('1', 'true', 'yes')  # HLS 频道经本服务器中继，多个观众共享一路上游
+RELAY_CACHE_MB = int(os.getenv('RELAY_CACHE_MB', config['network'].get('relay_cache_mb', 256)))  # 中继切片缓存大小（MB）
+RELAY_TS = str(os.getenv('RELAY_TS', config['network'].get('relay_ts', False))).lower() in ('1', 'true', 'yes')  # TS 频道经本服务器转发，上游失效时切换直播源
+RELAY_MIN_SPEED = int(os.getenv('RELAY_MIN_SPEED', config['network'].get('relay_min_speed', 64)))  # 上游吞吐低于该值（KB/s）持续 RELAY_STALL_SECONDS 秒时切换直播源
+RELAY_STALL_SECONDS = int(os.getenv('RELAY_STALL_SECONDS', config['network'].get('relay_stall_seconds', 5)))  # 判定上游失效的时间（秒）
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', config['network'].get('server_threads', 16)))  # Waitress 线程数，每个 TS 中继观众占用一个线程
+RESERVED_THREADS = 4  # 至少留给重定向、健康检查和 HLS 中继的线程数
+# 同时转发的 TS 流上限，不超过 SERVER_THREADS - RESERVED_THREADS，超过时改为直接重定向到直播源
+RELAY_TS_MAX_STREAMS = max(1, min(int(os.getenv('RELAY_TS_MAX_STREAMS', config['network'].get('relay_ts_max_streams', 8))), SERVER_THREADS - RESERVED_THREADS))
+DEMAND_WINDOW_HOURS = int(os.getenv('DEMAND_WINDOW_HOURS', config['scheduler'].get('demand_window_hours', 24)))  # 访问计数保留的时间窗口（小时）
 
-def get_channel_sources(aliasesname):
-    try:
-        conn = sqlite3.connect("data/filtered_sources_readonly.db")
-        query = """
-        SELECT * FROM filtered_playlists_readonly
-        WHERE aliasesname = ?
-        AND download_speed > 0
-        AND latency IS NOT NULL
-        ORDER BY score DESC  -- 根据评分机制选择直播源
-        """
-        df = pd.read_sql_query(query, conn, params=(aliasesname,))
-        
-        if not df.empty:
-            return df
-        else:
-            logger.warning(f"No valid sources found for {aliasesname}")
-            return None
-    except Exception as e:
-        logger.error(f"Failed to get channel sources for {aliasesname}: {e}")
-        return None
-    finally:
-        conn.close()
+# 重定向只在内存中计数，由后台线程定期写入 channel_demand.db，供 daily_monitor 安排测速
+demand = DemandCounter(flush_seconds=DEMAND_FLUSH_SECONDS, window_hours=DEMAND_WINDOW_HOURS)
+demand.start()
+
+# 快照由 daily_monitor 原子替换或增量同步，索引在快照变化后自动重新加载
+SNAPSHOT_PATH = 'data/filtered_sources_readonly.db'
+channel_index = ChannelIndex(SNAPSHOT_PATH)
+channel_index.maybe_reload()
+balancer = LoadBalancer(REDIRECT_MODE, REDIRECT_TOP_K, REDIRECT_STICKY_SECONDS)
+health = SourceHealth(HEALTH_CHECK, HEALTH_CHECK_TTL, HEALTH_CHECK_TIMEOUT, REREQUEST_SECONDS, REREQUEST_THRESHOLD, DEMOTE_SECONDS)
+
+def relay_upstream(aliasesname):
+    """中继使用频道中评分最高且检查可用的 HLS 直播源"""
+    for url, _ in health.rank(channel_index.lookup(aliasesname)):
+        if looks_like_hls(url) and health.check(url):
+            return url
+    return None
+
+hls_relay = HlsRelay(relay_upstream, health.demote, RELAY_CACHE_MB * 1024 * 1024, index_version=lambda: channel_index.version) if RELAY_HLS else None
+
+def relay_ts_candidates(aliasesname):
+    """TS 中继按评分顺序使用频道中未被降级的非 HLS 直播源"""
+    return [url for url, _ in health.rank(channel_index.lookup(aliasesname)) if not looks_like_hls(url)]
+
+ts_relay = TsRelay(relay_ts_candidates, health.demote, RELAY_MIN_SPEED, RELAY_STALL_SECONDS, max_streams=RELAY_TS_MAX_STREAMS) if RELAY_TS else None
 
 @app.route('/<aliasesname>')
 def redirect_channel(aliasesname):
-    sources = get_channel_sources(aliasesname)
-    if sources is not None:
-        for _, source in sources.iterrows():
-            try:
-                url = source['url']
-                logger.info(f"Attempting to redirect {aliasesname} to {url}")
-                return redirect(url)
-            except Exception as e:
-                logger.warning(f"Failed to redirect {aliasesname} to {url}: {e}")
-                continue  # 如果无法播放，继续尝试下一个源
-        logger.error(f"All sources for {aliasesname} failed.")
-        return "All sources failed", 500
-    else:
+    candidates = channel_index.lookup(aliasesname)
+    if not candidates:
         logger.warning(f"Channel not found: {aliasesname}")
         return "Channel not found", 404
 
+    client = request.remote_addr
+    # 同一出口地址后可能有多台设备，被动反馈按地址加 User-Agent 区分客户端，没有 User-Agent 时不使用
+    user_agent = request.headers.get('User-Agent')
+    health_client = (client, user_agent) if user_agent else None
+    demand.hit(aliasesname)
+    # 没有检查可用的 HLS 直播源时不经 HLS 中继，按 TS 中继或普通重定向处理
+    if hls_relay is not None and is_relayable(candidates) and hls_relay.upstream(aliasesname) is not None:
+        return redirect(f'/relay/{quote(aliasesname)}/index.m3u8')
+    return direct_redirect(aliasesname, candidates, client, health_client)
+
+def direct_redirect(aliasesname, candidates, client, health_client=None):
+    """不经 HLS 中继分配直播源：频道有 TS 直播源且开启 TS 中继时转发，否则重定向到检查可用的直播源"""
+    if ts_relay is not None and has_ts_sources(candidates):
+        return redirect(f'/relay/{quote(aliasesname)}/stream.ts')
+    health.record_request(health_client, aliasesname)
+    for _ in range(len(candidates)):
+        url = balancer.choose(aliasesname, health.rank(candidates), client)
+        if health.check(url):
+            health.record_assignment(health_client, aliasesname, url)
+            logger.info(f"Redirecting {aliasesname} to {url}")
+            return redirect(url)
+        # 检查失败的直播源已被降级，继续尝试下一个源
+    logger.error(f"All sources for {aliasesname} failed.")
+    return "All sources failed", 500
+
+def playlist_response(aliasesname, body):
+    if body is None:
+        # 频道的 HLS 直播源都不可用，改为 TS 中继或普通重定向
+        candidates = channel_index.lookup(aliasesname)
+        if not candidates:
+            return "Channel not found", 404
+        return direct_redirect(aliasesname, candidates, request.remote_addr)
+    return Response(body, mimetype='application/vnd.apple.mpegurl', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/relay/<aliasesname>/index.m3u8')
+def relay_channel_playlist(aliasesname):
+    if hls_relay is None:
+        return "Relay disabled", 404
+    try:
+        return playlist_response(aliasesname, hls_relay.channel_playlist(aliasesname))
+    except Exception as e:
+        logger.error(f"Error relaying playlist for {aliasesname}: {e}")
+        return "Upstream error", 502
+
+@app.route('/relay/<aliasesname>/p/<key>.m3u8')
+def relay_variant_playlist(aliasesname, key):
+    if hls_relay is None:
+        return "Relay disabled", 404
+    try:
+        return playlist_response(aliasesname, hls_relay.variant_playlist(aliasesname, key))
+    except Exception as e:
+        logger.error(f"Error relaying variant playlist {key} for {aliasesname}: {e}")
+        return "Upstream error", 502
+
+@app.route('/relay/<aliasesname>/s/<key>')
+def relay_segment(aliasesname, key):
+    if hls_relay is None:
+        return "Relay disabled", 404
+    try:
+        segment = hls_relay.segment(aliasesname, key)
+    except Exception as e:
+        logger.error(f"Error relaying segment {key} for {aliasesname}: {e}")
+        return "Upstream error", 502
+    if segment is None:
+        return "Segment not found", 404
+    content, content_type = segment
+    return Response(content, mimetype=content_type)
+
+@app.route('/relay/<aliasesname>/stream.ts')
+def relay_stream(aliasesname):
+    if ts_relay is None:
+        return "Relay disabled", 404
+    urls = relay_ts_candidates(aliasesname)
+    if not urls:
+        return "Channel not found", 404
+    if not ts_relay.acquire():
+        # 转发名额已满，保留线程给其他请求，直接重定向到评分最高的直播源
+        logger.warning(f"TS relay limit of {ts_relay.max_streams} streams reached, redirecting {aliasesname} to {urls[0]}")
+        return redirect(urls[0])
+    # 响应持续到客户端断开或所有直播源都失败，关闭时释放名额
+    response = Response(ts_relay.stream(aliasesname), mimetype='video/mp2t', headers={'Cache-Control': 'no-cache'})
+    response.call_on_close(ts_relay.release)
+    return response
+
+@app.route('/filtered_sources.xlsx')
+def serve_report():
+    # 报表只在请求时生成，快照更新后才会重新生成
+    try:
+        from export_report import ensure_report  # 依赖 pandas，只在请求报表时导入，不拖慢服务器启动
+        report_path = ensure_report(SNAPSHOT_PATH, "filtered_playlists_readonly", "data/filtered_sources.xlsx")
+        return send_file(os.path.abspath(report_path))
+    except Exception as e:
+        logger.error(f"Error serving Excel report: {e}")
+        return "Internal server error", 500
+
 @app.route('/aggregated_channels.m3u8')
 def serve_m3u8():
     try:
@@ -89,6 +202,6 @@ if __name__ == "__main__":
     try:
         # 使用 Waitress 启动 Flask 服务器，host 设置为 HOST_IP
         logger.info("Starting Flask server with Waitress...")
-        serve(app, host=HOST_IP, port=PORT, threads=2)  # 可根据需求调整 threads 参数
+        serve(app, host=HOST_IP, port=PORT, threads=SERVER_THREADS)  # 每个 TS 中继观众占用一个线程
     except Exception as e:
         logger.error(f"Failed to start Flask server: {e}")
@@ -0,0 +1,208 @@
+import re
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+# 直播播放列表超过 STALE_TARGET_DURATIONS 个切片时长（至少 MIN_STALE_SECONDS 秒）没有更新视为失效
+STALE_TARGET_DURATIONS = 6
+MIN_STALE_SECONDS = 60
+MAX_CLOCK_SKEW_SECONDS = 300  # 上游时间晚于本机超过该值时不用于判断
+MAX_PLAYLIST_AGE_SECONDS = 86400  # 上游时间早于本机超过该值时视为时钟错误
+
+def looks_like_hls(url, content_type=''):
+    """根据 URL 后缀或 Content-Type 判断是否为 HLS 播放列表"""
+    return url.split('?')[0].lower().endswith('.m3u8') or 'mpegurl' in content_type.lower()
+
+def is_playlist(data):
+    """判断响应内容是否为 M3U8 播放列表"""
+    return data.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'#EXTM3U')
+
+def parse_attributes(text):
+    """解析 #EXT-X-STREAM-INF 等标签的属性列表"""
+    return {key: value.strip('"') for key, value in ATTRIBUTE_PATTERN.findall(text)}
+
+def parse_playlist(text, base_url):
+    """解析 HLS 主播放列表或媒体播放列表，URI 统一转换为绝对地址"""
+    playlist = {
+        "is_master": False,
+        "variants": [],
+        "segments": [],
+        "target_duration": None,
+        "media_sequence": 0,
+        "endlist": False
+    }
+    pending_variant = None
+    pending_duration = None
+    pending_date_time = None
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            attributes = parse_attributes(line.split(':', 1)[1])
+            resolution = attributes.get('RESOLUTION', '')
+            pending_variant = {
+                "bandwidth": int(attributes.get('BANDWIDTH', 0) or 0),
+                "height": int(resolution.split('x')[1]) if 'x' in resolution else None,
+                "codecs": attributes.get('CODECS', '')
+            }
+            playlist["is_master"] = True
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            playlist["target_duration"] = float(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            playlist["media_sequence"] = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-ENDLIST'):
+            playlist["endlist"] = True
+        elif line.startswith('#EXTINF:'):
+            pending_duration = float(line.split(':', 1)[1].split(',')[0] or 0)
+        elif line.startswith('#EXT-X-PROGRAM-DATE-TIME:'):
+            pending_date_time = line.split(':', 1)[1]
+        elif not line.startswith('#'):
+            uri = urljoin(base_url, line)
+            if pending_variant is not None:
+                pending_variant["uri"] = uri
+                playlist["variants"].append(pending_variant)
+                pending_variant = None
+            else:
+                playlist["segments"].append({"uri": uri, "duration": pending_duration, "program_date_time": pending_date_time})
+                pending_duration = None
+                pending_date_time = None
+
+    return playlist
+
+URI_ATTRIBUTE_PATTERN = re.compile(r'URI="([^"]*)"')
+PLAYLIST_URI_TAGS = ('#EXT-X-MEDIA:', '#EXT-X-I-FRAME-STREAM-INF:')  # URI 属性指向子播放列表的标签
+
+def rewrite_playlist(text, base_url, rewrite_uri):
+    """把播放列表中的所有 URI 转换为绝对地址后交给 rewrite_uri(kind, uri) 替换
+
+    kind 为 playlist（子播放列表）或 segment（切片、密钥和初始化分段），其余内容保持不变。
+    """
+    lines = []
+    next_is_variant = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith('#'):
+            if 'URI="' in stripped:
+                kind = 'playlist' if stripped.startswith(PLAYLIST_URI_TAGS) else 'segment'
+                stripped = URI_ATTRIBUTE_PATTERN.sub(lambda match: f'URI="{rewrite_uri(kind, urljoin(base_url, match.group(1)))}"', stripped)
+            if stripped.startswith('#EXT-X-STREAM-INF:'):
+                next_is_variant = True
+            lines.append(stripped)
+        else:
+            lines.append(rewrite_uri('playlist' if next_is_variant else 'segment', urljoin(base_url, stripped)))
+            next_is_variant = False
+    return '\n'.join(lines) + '\n'
+
+def choose_variant(variants):
+    """选择带宽最高的子播放列表"""
+    return max(variants, key=lambda variant: variant["bandwidth"]) if variants else None
+
+def plausible_age(updated):
+    """返回 updated（带时区的 datetime）距现在的秒数，没有时区或与本机时钟相差过大时返回 None"""
+    if updated.tzinfo is None:
+        return None  # 没有时区的时间无法确定对应的时刻
+    age = time.time() - updated.timestamp()
+    if age < -MAX_CLOCK_SKEW_SECONDS or age > MAX_PLAYLIST_AGE_SECONDS:
+        return None  # 上游时钟或时区设置错误
+    return max(age, 0)
+
+def playlist_age(playlist, headers):
+    """估算直播播放列表距上次更新的秒数，无法判断时返回 None
+
+    优先使用最新切片的 EXT-X-PROGRAM-DATE-TIME 减去切片时长，其次使用 Last-Modified 响应头。
+    没有时区、晚于本机时间超过 MAX_CLOCK_SKEW_SECONDS 或早于 MAX_PLAYLIST_AGE_SECONDS 的时间视为上游时钟错误，不使用。
+    EXT-X-PROGRAM-DATE-TIME 与本机时间相差接近整小时时可能是时区错误，有 Last-Modified 时以它为准，
+    没有时仍按 EXT-X-PROGRAM-DATE-TIME 计算，停止更新整几个小时的播放列表不会被当作正常。
+    """
+    modified_age = None
+    if headers.get('Last-Modified'):
+        try:
+            modified_age = plausible_age(parsedate_to_datetime(headers['Last-Modified']))
+        except (ValueError, TypeError):
+            pass
+
+    newest = playlist["segments"][-1] if playlist["segments"] else None
+    if newest and newest["program_date_time"]:
+        try:
+            age = plausible_age(datetime.fromisoformat(newest["program_date_time"]))
+        except (ValueError, TypeError):
+            age = None
+        if age is not None:
+            age = max(age - (newest["duration"] or 0), 0)
+            offset = age % 3600
+            if age >= 3600 and min(offset, 3600 - offset) <= MAX_CLOCK_SKEW_SECONDS and modified_age is not None:
+                return modified_age
+            return age
+    return modified_age
+
+async def fetch_media_playlist(session, url, timeout):
+    """获取媒体播放列表，主播放列表会解析到带宽最高的子列表
+
+    返回 (playlist, media_url, 响应头)，请求失败时 playlist 为 None。
+    """
+    for _ in range(2):  # 最多解析一层主播放列表
+        async with session.get(url, timeout=timeout) as response:
+            if response.status != 200:
+                return None, url, response.headers
+            text = await response.text(errors='ignore')
+            headers = response.headers
+            url = str(response.url)
+        playlist = parse_playlist(text, url)
+        if not playlist["is_master"]:
+            return playlist, url, headers
+        variant = choose_variant(playlist["variants"])
+        if variant is None:
+            return None, url, headers
+        url = variant["uri"]
+    return None, url, headers
+
+async def check_segment(session, url, timeout):
+    """检测切片是否可以下载，不支持 HEAD 的服务器改用 Range 请求读取一个 TS 包"""
+    async with session.head(url, timeout=timeout, allow_redirects=True) as response:
+        if response.status == 200:
+            return response.headers.get('Content-Length') != '0'
+        if response.status not in (403, 405, 501):
+            return False
+    async with session.get(url, timeout=timeout, headers={'Range': 'bytes=0-187'}) as response:
+        return response.status in (200, 206) and len(await response.content.read(188)) > 0
+
+async def check_hls(session, url, timeout):
+    """HLS 可用性检测：解析主播放列表、获取媒体播放列表并检测最新切片
+
+    返回检测信息字典，ok 为 False 时 reason 说明失败原因。
+    """
+    info = {"ok": False, "reason": None, "target_duration": None, "age": None, "segments": 0, "media_url": url, "newest_segment": None}
+
+    playlist, info["media_url"], headers = await fetch_media_playlist(session, url, timeout)
+    if playlist is None:
+        info["reason"] = "playlist unavailable"
+        return info
+
+    info["target_duration"] = playlist["target_duration"]
+    info["segments"] = len(playlist["segments"])
+    if not playlist["segments"]:
+        info["reason"] = "empty media playlist"
+        return info
+
+    if not playlist["endlist"]:
+        info["age"] = playlist_age(playlist, headers)
+        stale_after = max((playlist["target_duration"] or 0) * STALE_TARGET_DURATIONS, MIN_STALE_SECONDS)
+        if info["age"] is not None and info["age"] > stale_after:
+            info["reason"] = f"stale playlist ({int(info['age'])}s old)"
+            return info
+
+    info["newest_segment"] = playlist["segments"][-1]["uri"]
+    if not await check_segment(session, info["newest_segment"], timeout):
+        info["reason"] = "newest segment unavailable"
+        return info
+
+    info["ok"] = True
+    return info
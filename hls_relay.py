@@ -0,0 +1,263 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+import requests
+from hls_playlist import rewrite_playlist, is_playlist, looks_like_hls, parse_playlist, choose_variant
+from logging_config import logger  # 使用外部的日志配置
+
+MAX_TARGETS = 20000  # 记住的上游地址数，超过时淘汰最久未使用的
+MAX_PLAYLISTS = 1000  # 缓存的播放列表数
+MAX_UPSTREAM_ERRORS = 3  # 子播放列表或切片连续失败几次后降级上游并换源
+
+class SingleFlight:
+    """同一个键同时只执行一次 fn，其他调用方等待并共享结果或异常"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"event": threading.Event(), "result": None, "error": None}
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["event"].set()
+        return call["result"]
+
+class ByteLRU:
+    """按总字节数限制大小的 LRU 缓存，值为 (内容, Content-Type)"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        length = len(value[0])
+        if length > self.max_bytes // 4:
+            return  # 过大的分段不缓存，避免挤掉其他频道
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.items[key] = value
+            self.size += length
+            while self.size > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted[0])
+
+class HlsRelay:
+    """HLS 中继：同一频道的所有观众共享一路上游拉流
+
+    每个频道固定使用一个上游直播源，播放列表最多每 playlist_ttl 秒从上游获取一次，
+    其中的子播放列表、切片、密钥地址改写为指向中继的 /relay/<频道>/p|s/<key>。
+    切片下载后放入按字节数限制的内存 LRU，同一地址同时只向上游请求一次，
+    之后的观众直接从缓存读取，上游带宽从每个观众一路变为每个频道一路。
+
+    choose_upstream(aliasesname) 返回频道当前可用的 HLS 地址，
+    on_upstream_failure(url, reason) 在上游主播放列表获取失败、或子播放列表和切片连续失败
+    MAX_UPSTREAM_ERRORS 次时调用，之后换下一个直播源。
+    index_version() 返回频道索引的版本，版本变化（快照更新）后重新选择上游。
+    换源后仍在请求旧上游子播放列表的观众得到新上游对应的媒体播放列表。
+    """
+
+    def __init__(self, choose_upstream, on_upstream_failure, cache_bytes, playlist_ttl=1.0, timeout=10, index_version=None):
+        self.choose_upstream = choose_upstream
+        self.on_upstream_failure = on_upstream_failure
+        self.index_version = index_version or (lambda: None)
+        self.playlist_ttl = playlist_ttl
+        self.timeout = timeout
+        self.local = threading.local()  # 每个 WSGI 线程一个 requests.Session，Session 不是线程安全的
+        self.upstreams = {}  # aliasesname -> (当前使用的上游地址, 选择时的索引版本)
+        self.errors = {}  # aliasesname -> 当前上游子播放列表和切片的连续失败次数
+        self.targets = OrderedDict()  # key -> (上游绝对地址, 所属的频道上游)
+        self.playlists = {}  # (aliasesname, 上游地址) -> (改写后的播放列表, 获取时间)，改写结果包含频道路径，不能跨频道共享
+        self.segments = ByteLRU(cache_bytes)
+        self.flights = SingleFlight()
+        self.lock = threading.Lock()
+
+    def get_session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session
+
+    def relay_path(self, aliasesname, upstream, kind, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]
+        with self.lock:
+            self.targets[key] = (url, upstream)
+            self.targets.move_to_end(key)
+            while len(self.targets) > MAX_TARGETS:
+                self.targets.popitem(last=False)
+        if kind == 'playlist':
+            return f'/relay/{quote(aliasesname)}/p/{key}.m3u8'
+        return f'/relay/{quote(aliasesname)}/s/{key}'
+
+    def target(self, key):
+        with self.lock:
+            return self.targets.get(key)
+
+    def upstream(self, aliasesname):
+        """返回频道当前使用的上游，没有可用的 HLS 直播源时返回 None"""
+        version = self.index_version()
+        with self.lock:
+            pinned = self.upstreams.get(aliasesname)
+        if pinned is not None and pinned[1] == version:
+            return pinned[0]
+
+        upstream = self.choose_upstream(aliasesname)
+        with self.lock:
+            if upstream is None:
+                self.upstreams.pop(aliasesname, None)
+            else:
+                self.upstreams[aliasesname] = (upstream, version)
+            self.errors.pop(aliasesname, None)
+        return upstream
+
+    def drop_upstream(self, aliasesname, upstream, reason):
+        """降级上游并取消频道对它的固定，下次请求时重新选择"""
+        with self.lock:
+            pinned = self.upstreams.get(aliasesname)
+            if pinned is not None and pinned[0] == upstream:
+                del self.upstreams[aliasesname]
+            self.errors.pop(aliasesname, None)
+        logger.warning(f"Relay upstream {upstream} for {aliasesname} dropped: {reason}")
+        self.on_upstream_failure(upstream, reason)
+
+    def record_error(self, aliasesname, upstream, reason):
+        with self.lock:
+            pinned = self.upstreams.get(aliasesname)
+            if pinned is None or pinned[0] != upstream:
+                return  # 已经换了上游，旧上游的失败不再计数
+            count = self.errors.get(aliasesname, 0) + 1
+            self.errors[aliasesname] = count
+        if count >= MAX_UPSTREAM_ERRORS:
+            self.drop_upstream(aliasesname, upstream, f"{reason} ({count} errors in a row)")
+
+    def record_success(self, aliasesname, upstream):
+        with self.lock:
+            pinned = self.upstreams.get(aliasesname)
+            if pinned is not None and pinned[0] == upstream:
+                self.errors.pop(aliasesname, None)
+
+    def channel_playlist(self, aliasesname):
+        """返回频道改写后的播放列表，频道没有可用的 HLS 直播源时返回 None"""
+        for _ in range(2):  # 当前上游失败时换一个直播源重试一次
+            upstream = self.upstream(aliasesname)
+            if upstream is None:
+                return None
+            try:
+                return self.playlist(aliasesname, upstream, upstream)
+            except (requests.RequestException, ValueError) as e:
+                self.drop_upstream(aliasesname, upstream, f"relay playlist fetch failed: {e}")
+        return None
+
+    def variant_playlist(self, aliasesname, key):
+        """返回改写后的子播放列表，频道没有可用的 HLS 直播源时返回 None
+
+        key 不属于频道当前的上游（已换源）或已被淘汰时，返回当前上游的媒体播放列表。
+        """
+        upstream = self.upstream(aliasesname)
+        if upstream is None:
+            return None
+        target = self.target(key)
+        if target is None or target[1] != upstream:
+            return self.media_playlist(aliasesname)
+        return self.relay_variant(aliasesname, upstream, target[0])
+
+    def media_playlist(self, aliasesname):
+        """返回频道当前上游的媒体播放列表，上游为主播放列表时选择带宽最高的子播放列表"""
+        body = self.channel_playlist(aliasesname)
+        upstream = self.upstream(aliasesname)
+        if body is None or upstream is None:
+            return None
+        # 改写后的地址是中继路径，以任意主机为基准解析后取出 key
+        variant = choose_variant(parse_playlist(body, 'http://relay/')["variants"])
+        if variant is None:
+            return body
+        target = self.target(variant["uri"].rsplit('/', 1)[1][:-len('.m3u8')])
+        if target is None:
+            return body
+        return self.relay_variant(aliasesname, upstream, target[0])
+
+    def relay_variant(self, aliasesname, upstream, url):
+        try:
+            body = self.playlist(aliasesname, upstream, url)
+        except (requests.RequestException, ValueError) as e:
+            self.record_error(aliasesname, upstream, f"relay variant playlist fetch failed: {e}")
+            raise
+        self.record_success(aliasesname, upstream)
+        return body
+
+    def playlist(self, aliasesname, upstream, url):
+        cached = self.playlists.get((aliasesname, url))
+        if cached is not None and time.monotonic() - cached[1] < self.playlist_ttl:
+            return cached[0]
+
+        def fetch():
+            response = self.get_session().get(url, timeout=self.timeout)
+            response.raise_for_status()
+            if not is_playlist(response.content[:64]):
+                raise ValueError("upstream did not return an HLS playlist")
+            body = rewrite_playlist(response.text, response.url, lambda kind, uri: self.relay_path(aliasesname, upstream, kind, uri))
+            now = time.monotonic()
+            if len(self.playlists) >= MAX_PLAYLISTS:
+                self.playlists = {key: value for key, value in self.playlists.items() if now - value[1] < self.playlist_ttl}
+            self.playlists[(aliasesname, url)] = (body, now)
+            return body
+
+        return self.flights.do(('playlist', aliasesname, url), fetch)
+
+    def segment(self, aliasesname, key):
+        """返回切片的 (内容, Content-Type)，key 未知时返回 None"""
+        target = self.target(key)
+        if target is None:
+            return None
+        url, upstream = target
+        cached = self.segments.get(url)
+        if cached is not None:
+            return cached
+
+        def fetch():
+            response = self.get_session().get(url, timeout=self.timeout)
+            response.raise_for_status()
+            value = (response.content, response.headers.get('Content-Type', 'video/mp2t'))
+            self.segments.put(url, value)
+            return value
+
+        try:
+            value = self.flights.do(('segment', url), fetch)
+        except requests.RequestException as e:
+            self.record_error(aliasesname, upstream, f"relay segment fetch failed: {e}")
+            raise
+        self.record_success(aliasesname, upstream)
+        return value
+
+def is_relayable(candidates):
+    """频道中是否有 HLS 直播源可以中继"""
+    return any(looks_like_hls(url) for url, _ in candidates)
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+import aiohttp
+from logging_config import logger  # 使用外部的日志配置
+
+# 视为主机连接失败的异常，HTTP 状态码错误说明主机在线，不计入
+CONNECT_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ServerTimeoutError, asyncio.TimeoutError, ConnectionError, OSError)
+
+def host_of(url):
+    """返回 URL 的 host:port，用于按主机分组"""
+    try:
+        return urlsplit(url).netloc.lower()
+    except ValueError:
+        return url
+
+def group_by_host(sources):
+    """按主机分组直播源，返回 {host: [source, ...]}，保持原有顺序"""
+    groups = {}
+    for source in sources:
+        groups.setdefault(host_of(source["url"]), []).append(source)
+    return groups
+
+def interleave_by_host(sources):
+    """按主机轮流排列直播源，避免线程池中的所有线程同时等待同一个主机"""
+    queues = [deque(group) for group in group_by_host(sources).values()]
+    ordered = []
+    index = 0
+    while queues:
+        position = index % len(queues)
+        queue = queues[position]
+        ordered.append(queue.popleft())
+        if queue:
+            index = position + 1
+        else:
+            del queues[position]
+            index = position
+    return ordered
+
+class HostHealth:
+    """主机级熔断器：同一主机连续连接失败达到阈值后，本轮检测跳过该主机的剩余直播源
+
+    两个检测脚本共用，内部加锁，可在线程池和事件循环中使用。
+    """
+
+    def __init__(self, failure_threshold):
+        self.failure_threshold = failure_threshold
+        self.failures = {}
+        self.tripped = set()
+        self.lock = threading.Lock()
+
+    def is_tripped(self, host):
+        if self.failure_threshold <= 0:
+            return False
+        with self.lock:
+            return host in self.tripped
+
+    def record_success(self, host):
+        with self.lock:
+            self.failures.pop(host, None)
+
+    def record_failure(self, host):
+        if self.failure_threshold <= 0:
+            return
+        with self.lock:
+            count = self.failures.get(host, 0) + 1
+            self.failures[host] = count
+            if count >= self.failure_threshold and host not in self.tripped:
+                self.tripped.add(host)
+                logger.warning(f"Host {host} failed {count} consecutive connections, skipping its remaining sources in this run")
+
+    def reset(self):
+        """开始新一轮检测，清除所有主机的失败记录和熔断状态"""
+        with self.lock:
+            self.failures.clear()
+            self.tripped.clear()
+
+    def summary(self):
+        with self.lock:
+            return len(self.tripped)
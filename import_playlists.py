@@ -4,6 +4,7 @@ import sqlite3
 import glob
 import concurrent.futures
 from difflib import SequenceMatcher
+from calculate_score import rescore_table  # 按测速统计重新计算评分
 from logging_config import logger  # 引入日志配置
 
 logger.info("开始执行 直播源导入 任务")
@@ -55,15 +56,18 @@ def match_tvg_name(text, sources):
     # 如果没有找到匹配，返回None
     return None
 
-def reset_scores_if_table_exists(cursor):
-    """如果 filtered_playlists 表存在，清零评分"""
+def rescore_if_table_exists(conn):
+    """如果 filtered_playlists 表存在，按已保存的测速统计重新计算评分
+
+    按访问量安排测速时，没人看的频道可能一天才测一次，不能清零评分等下一次测速。
+    """
+    cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='filtered_playlists'")
     table_exists = cursor.fetchone() is not None
 
     if table_exists:
-        logger.info("Table filtered_playlists exists. Resetting scores...")
-        cursor.execute('UPDATE filtered_playlists SET score = 0')
-        logger.info("Scores reset successfully.")
+        logger.info("Table filtered_playlists exists. Rescoring from measurement statistics...")
+        logger.info(f"Rescored {rescore_table(conn)} sources.")
     else:
         logger.info("Table filtered_playlists does not exist. Skipping score reset.")
 
@@ -126,8 +130,8 @@ def import_playlists():
             cursor.execute('SELECT title, url FROM failed_sources')
             failed_sources_set = set(cursor.fetchall())
 
-        # 重置评分，如果 filtered_playlists 表存在
-        reset_scores_if_table_exists(cursor)
+        # 重新计算评分，如果 filtered_playlists 表存在
+        rescore_if_table_exists(conn)
 
         # 创建元数据表，如果不存在则创建
         cursor.execute('''
@@ -0,0 +1,93 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+
+REDIRECT_MODES = ('top', 'weighted', 'round_robin')
+MAX_STICKY_CLIENTS = 10000  # 粘性记录的最大条数，超过时淘汰最久未使用的记录
+
+class LoadBalancer:
+    """在频道评分最高的 top_k 个直播源之间分配重定向
+
+    候选直播源为 (url, weight)，按评分从高到低排列，weight 由评分和下载速度得出。
+    mode 为 top 时总是选择评分最高的直播源；weighted 按权重随机选择；
+    round_robin 为平滑加权轮询，每个直播源按权重比例轮流分配，分配最少的先被选中。
+    sticky_seconds 大于 0 时同一客户端在该时间内观看同一频道总是得到同一个直播源，
+    该直播源不再是候选时重新选择。
+    """
+
+    def __init__(self, mode='top', top_k=3, sticky_seconds=0):
+        if mode not in REDIRECT_MODES:
+            raise ValueError(f"Unknown redirect mode {mode!r}, expected one of {REDIRECT_MODES}")
+        self.mode = mode
+        self.top_k = max(1, top_k)
+        self.sticky_seconds = sticky_seconds
+        self.rotations = {}  # aliasesname -> (候选 URL 元组, 平滑加权轮询的当前值)
+        self.sticky = OrderedDict()  # (client, aliasesname) -> (url, 过期时间)
+        self.lock = threading.Lock()
+
+    def choose(self, aliasesname, candidates, client=None):
+        """从 candidates 中为 client 选择一个 URL，candidates 为空时返回 None"""
+        if not candidates:
+            return None
+        candidates = candidates[:self.top_k]
+        if self.mode == 'top' or len(candidates) == 1:
+            return candidates[0][0]
+
+        with self.lock:
+            key = (client, aliasesname)
+            if self.sticky_seconds > 0 and client is not None:
+                url = self.sticky_url(key, candidates)
+                if url is not None:
+                    return url
+
+            if self.mode == 'weighted':
+                url = self.weighted_choice(candidates)
+            else:
+                url = self.round_robin(aliasesname, candidates)
+
+            if self.sticky_seconds > 0 and client is not None:
+                self.sticky[key] = (url, time.monotonic() + self.sticky_seconds)
+                self.sticky.move_to_end(key)
+                while len(self.sticky) > MAX_STICKY_CLIENTS:
+                    self.sticky.popitem(last=False)
+            return url
+
+    def sticky_url(self, key, candidates):
+        entry = self.sticky.get(key)
+        if entry is None:
+            return None
+        url, expires_at = entry
+        if expires_at < time.monotonic() or all(url != candidate for candidate, _ in candidates):
+            del self.sticky[key]
+            return None
+        # 续期，正在观看的客户端不会被切换到其他直播源
+        self.sticky[key] = (url, time.monotonic() + self.sticky_seconds)
+        self.sticky.move_to_end(key)
+        return url
+
+    @staticmethod
+    def weighted_choice(candidates):
+        weights = [weight for _, weight in candidates]
+        if sum(weights) <= 0:
+            return random.choice(candidates)[0]
+        return random.choices(candidates, weights=weights)[0][0]
+
+    def round_robin(self, aliasesname, candidates):
+        urls = tuple(url for url, _ in candidates)
+        weights = [weight for _, weight in candidates]
+        if sum(weights) <= 0:
+            weights = [1] * len(candidates)
+
+        # 候选直播源变化（快照更新）后重新开始轮询
+        rotation = self.rotations.get(aliasesname)
+        if rotation is None or rotation[0] != urls:
+            rotation = (urls, [0.0] * len(urls))
+            self.rotations[aliasesname] = rotation
+        current = rotation[1]
+
+        for i, weight in enumerate(weights):
+            current[i] += weight
+        chosen = max(range(len(current)), key=current.__getitem__)
+        current[chosen] -= sum(weights)
+        return urls[chosen]
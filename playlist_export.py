@@ -0,0 +1,61 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from logging_config import logger  # 使用外部的日志配置
+
+EXPORT_CHUNK_SIZE = 1000  # 每次从游标读取的行数
+
+def iter_rows(cursor, query, params=()):
+    """分批从游标读取查询结果，不把整张表加载到内存"""
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+@contextmanager
+def open_atomic(path):
+    """写入同目录下的临时文件，完成后原子替换目标文件，读取方不会看到写了一半的文件
+
+    临时文件名唯一，常驻检测和定时任务同时导出时互不覆盖对方的临时文件。
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def export_source_playlist(conn, path):
+    """导出检测筛选后可播放的直播源列表，返回写入的直播源数"""
+    count = 0
+    with open_atomic(path) as f:
+        for title, url in iter_rows(conn.cursor(), 'SELECT title, url FROM filtered_playlists ORDER BY id'):
+            f.write(f'#EXTINF:-1,{title}\n')
+            f.write(f'{url}\n')
+            count += 1
+    logger.info(f"Exported {count} sources to {path}")
+    return count
+
+def export_aggregated_playlist(conn, path, host_ip, port):
+    """导出局域网播放使用的频道列表，每个频道一条，指向重定向服务器，返回写入的频道数"""
+    unique_channels = set()
+    with open_atomic(path) as f:
+        f.write("#EXTM3U\n")
+        for aliasesname, tvg_name, group_title, title in iter_rows(conn.cursor(), '''
+        SELECT aliasesname, tvg_name, group_title, title FROM filtered_playlists_readonly
+        WHERE download_speed > 0
+        AND latency IS NOT NULL
+        ORDER BY tvordero ASC
+        '''):
+            if aliasesname in unique_channels:
+                continue
+            f.write(f"#EXTINF:-1 tvg-name=\"{tvg_name}\" group-title=\"{group_title}\",{title}\n")
+            f.write(f"http://{host_ip}:{port}/{aliasesname}\n")
+            unique_channels.add(aliasesname)
+    logger.info(f"Exported {len(unique_channels)} channels to {path}")
+    return len(unique_channels)
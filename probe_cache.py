@@ -0,0 +1,95 @@
+from logging_config import logger  # 使用外部的日志配置
+from hls_playlist import looks_like_hls
+
+# 指纹使用的响应头，直播源通常只会提供其中的一部分
+FINGERPRINT_HEADERS = ('ETag', 'Last-Modified', 'Content-Length')
+
+def build_fingerprint(url, headers):
+    """根据 HEAD 响应头生成上游指纹，无法生成时返回 None
+
+    HLS 播放列表的这些响应头会随切片滚动不断变化，因此不参与指纹比较，只依赖 TTL。
+    """
+    if looks_like_hls(url, headers.get('Content-Type', '')):
+        return None
+
+    parts = [f"{name}={headers[name]}" for name in FINGERPRINT_HEADERS if headers.get(name)]
+    return '|'.join(parts) if parts else None
+
+class ProbeCache:
+    """以 URL 为键的 ffprobe 结果缓存，保存在 probe_cache 表中，同时记录 HLS 检测信息"""
+
+    def __init__(self, cursor, ttl_minutes):
+        self.cursor = cursor
+        self.ttl_minutes = ttl_minutes
+        self.entries = {}
+        self.pending = []
+        self.pending_hls = []
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS probe_cache (
+            url TEXT PRIMARY KEY,
+            height INTEGER,
+            codec TEXT,
+            fingerprint TEXT,
+            probed_at TIMESTAMP
+        )
+        ''')
+
+        # HLS 检测记录：切片时长、播放列表距上次更新的秒数和检测结果
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS hls_status (
+            url TEXT PRIMARY KEY,
+            target_duration FLOAT,
+            playlist_age FLOAT,
+            segment_count INTEGER,
+            ok INTEGER,
+            reason TEXT,
+            checked_at TIMESTAMP
+        )
+        ''')
+
+        if ttl_minutes > 0:
+            # 只加载 TTL 内的记录，过期记录等同于未缓存
+            cursor.execute('''
+            SELECT url, height, codec, fingerprint FROM probe_cache
+            WHERE probed_at >= datetime('now', 'localtime', ?)
+            ''', (f'-{ttl_minutes} minutes',))
+            self.entries = {url: (height, codec, fingerprint) for url, height, codec, fingerprint in cursor.fetchall()}
+            logger.info(f"Loaded {len(self.entries)} probe cache entries within {ttl_minutes} minutes.")
+
+    def get(self, url, fingerprint):
+        """返回缓存的 (height, codec)，缓存不存在或上游指纹已变化时返回 None"""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+
+        height, codec, cached_fingerprint = entry
+        if fingerprint and cached_fingerprint and fingerprint != cached_fingerprint:
+            logger.info(f"Upstream changed, probe cache invalidated for {url}")
+            return None
+        return height, codec
+
+    def put(self, url, height, codec, fingerprint):
+        """记录新的检测结果，调用 flush 后写入数据库"""
+        if self.ttl_minutes <= 0 or height == "Unknown":
+            return
+        self.entries[url] = (height, codec, fingerprint)
+        self.pending.append((url, height, codec, fingerprint))
+
+    def put_hls(self, url, hls):
+        """记录 HLS 检测信息，调用 flush 后写入数据库"""
+        self.pending_hls.append((url, hls["target_duration"], hls["age"], hls["segments"], int(hls["ok"]), hls["reason"]))
+
+    def flush(self):
+        if self.pending:
+            self.cursor.executemany('''
+            INSERT OR REPLACE INTO probe_cache (url, height, codec, fingerprint, probed_at)
+            VALUES (?, ?, ?, ?, datetime('now', 'localtime'))
+            ''', self.pending)
+            self.pending = []
+        if self.pending_hls:
+            self.cursor.executemany('''
+            INSERT OR REPLACE INTO hls_status (url, target_duration, playlist_age, segment_count, ok, reason, checked_at)
+            VALUES (?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))
+            ''', self.pending_hls)
+            self.pending_hls = []
@@ -0,0 +1,54 @@
+import time
+from channel_demand import probe_interval_minutes
+
+SCHEDULE_SLACK = 0.1  # 下一次测速提前最短间隔的该比例到期，避免正好错过下一轮测速
+
+def setup_schedule_table(cursor):
+    """每个直播源下一次测速的时间，没有记录的直播源视为立即到期"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS probe_schedule (
+        source_id INTEGER PRIMARY KEY,
+        next_due_at TIMESTAMP NOT NULL
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_probe_schedule_due ON probe_schedule (next_due_at)')
+
+def select_due_sources(cursor):
+    """返回到期需要测速的直播源 (id, url, resolution, format, aliasesname)，最早到期的排在前面"""
+    cursor.execute('''
+    SELECT f.id, f.url, f.resolution, f.format, f.aliasesname
+    FROM filtered_playlists f LEFT JOIN probe_schedule s ON s.source_id = f.id
+    WHERE s.next_due_at IS NULL OR s.next_due_at <= datetime('now', 'localtime')
+    ORDER BY s.next_due_at IS NOT NULL, s.next_due_at
+    ''')
+    return cursor.fetchall()
+
+def load_schedule(cursor):
+    """返回所有直播源 (id, url, resolution, format, aliasesname, next_due)，next_due 为 Unix 时间戳，尚未安排时为 None"""
+    cursor.execute('''
+    SELECT f.id, f.url, f.resolution, f.format, f.aliasesname, CAST(strftime('%s', s.next_due_at, 'utc') AS INTEGER)
+    FROM filtered_playlists f LEFT JOIN probe_schedule s ON s.source_id = f.id
+    ''')
+    return cursor.fetchall()
+
+def next_interval_seconds(source, demand, min_interval, max_interval):
+    """source 下一次测速距现在的秒数"""
+    return int(probe_interval_minutes(demand.get(source["aliasesname"], 0), min_interval, max_interval) * 60)
+
+def next_due_time(source, demand, min_interval, max_interval, started_at=None):
+    """source 下一次测速的 Unix 时间戳
+
+    从本轮测速的开始时间 started_at（默认为现在）起算，并提前 min_interval 的 SCHEDULE_SLACK，
+    本轮中较晚测到的直播源在下一轮开始时同样已经到期。
+    """
+    base = time.time() if started_at is None else started_at
+    return base + next_interval_seconds(source, demand, min_interval, max_interval) - min_interval * 60 * SCHEDULE_SLACK
+
+def schedule_next(cursor, sources, demand, min_interval, max_interval, started_at=None):
+    """按频道访问次数安排 sources 中每个直播源的下一次测速时间"""
+    cursor.executemany('''
+    INSERT OR REPLACE INTO probe_schedule (source_id, next_due_at)
+    VALUES (?, datetime(?, 'unixepoch', 'localtime'))
+    ''', [(source["id"], int(next_due_time(source, demand, min_interval, max_interval, started_at))) for source in sources])
+    # 已不在 filtered_playlists 中的直播源不再需要安排
+    cursor.execute('DELETE FROM probe_schedule WHERE source_id NOT IN (SELECT id FROM filtered_playlists)')
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import signal
+from logging_config import logger  # 使用外部的日志配置
+
+async def run_process(command, timeout):
+    """异步运行子进程并返回 (returncode, stdout, stderr)
+
+    子进程在独立的进程组中启动，超时后整个进程组会被强制结束并回收，
+    避免 ffprobe/ffmpeg 及其派生进程残留。超时时抛出 asyncio.TimeoutError。
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True  # 新建会话，使子进程成为独立进程组的组长
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        return process.returncode, stdout, stderr
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        kill_process_group(process)
+        await process.wait()  # 回收子进程，避免产生僵尸进程
+        raise
+
+async def run_process_lines(command, on_line, timeout):
+    """异步运行子进程，逐行把 stdout 交给 on_line，on_line 返回 True 时提前结束子进程
+
+    返回 (returncode, stderr, 是否提前结束)。子进程同样在独立的进程组中启动，
+    超时时结束整个进程组并抛出 asyncio.TimeoutError。
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True  # 新建会话，使子进程成为独立进程组的组长
+    )
+    stderr_task = asyncio.create_task(process.stderr.read())
+
+    async def read_lines():
+        async for line in process.stdout:
+            if on_line(line.decode('utf-8', errors='ignore').strip()):
+                return True
+        return False
+
+    try:
+        stopped = await asyncio.wait_for(read_lines(), timeout=timeout)
+        if stopped:
+            kill_process_group(process)
+        await process.wait()
+        return process.returncode, await stderr_task, stopped
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        kill_process_group(process)
+        await process.wait()  # 回收子进程，避免产生僵尸进程
+        stderr_task.cancel()
+        raise
+
+def kill_process_group(process):
+    """强制结束子进程所在的整个进程组"""
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    except Exception as e:
+        logger.error(f"Failed to kill process group {process.pid}: {e}")
+        process.kill()
@@ -0,0 +1,46 @@
+from logging_config import logger  # 使用外部的日志配置
+
+class BatchWriter:
+    """检测结果的单一写入者
+
+    检测阶段只负责产生结果，所有数据库写入都由持有连接的线程通过本类完成。
+    结果先在内存中累积，达到 batch_size 后调用 flush_batch(cursor, successes, failures)
+    在一个事务中批量写入。
+    """
+
+    def __init__(self, conn, flush_batch, batch_size=500):
+        self.conn = conn
+        self.flush_batch = flush_batch
+        self.batch_size = batch_size
+        self.successes = []
+        self.failures = []
+        self.written = 0
+
+    def add(self, source, result):
+        if result:
+            self.successes.append(result)
+        else:
+            self.failures.append(source)
+        if len(self.successes) + len(self.failures) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.successes and not self.failures:
+            return
+        successes, failures = self.successes, self.failures
+        self.successes, self.failures = [], []
+
+        cursor = self.conn.cursor()
+        with self.conn:  # 单个事务，异常时整体回滚
+            self.flush_batch(cursor, successes, failures)
+        self.written += len(successes) + len(failures)
+        logger.info(f"Flushed {len(successes)} successes and {len(failures)} failures ({self.written} written in total).")
+
+    def close(self):
+        self.flush()
+
+def stage_ids(cursor, ids):
+    """将本批次的 id 写入临时表 batch_ids，供基于集合的 SQL 使用"""
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS batch_ids (id INTEGER PRIMARY KEY)')
+    cursor.execute('DELETE FROM batch_ids')
+    cursor.executemany('INSERT OR IGNORE INTO batch_ids (id) VALUES (?)', [(id_,) for id_ in ids])
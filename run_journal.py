@@ -0,0 +1,82 @@
+from logging_config import logger  # 使用外部的日志配置
+
+def setup_journal_tables(cursor):
+    """创建检测轮次表和逐条结果日志表"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS probe_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stage TEXT NOT NULL,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS probe_journal (
+        run_id INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        ok INTEGER NOT NULL,
+        recorded_at TIMESTAMP,
+        PRIMARY KEY (run_id, source_id)
+    )
+    ''')
+
+def start_run(conn, stage, resume_max_age_hours=24):
+    """开始或恢复某个检测阶段的一轮检测
+
+    如果该阶段存在未完成且开始时间在 resume_max_age_hours 以内的轮次，则恢复它，
+    返回 (run_id, 已处理的 source_id 集合, True)；否则新建一轮，返回 (run_id, 空集合, False)。
+    """
+    cursor = conn.cursor()
+    setup_journal_tables(cursor)
+
+    cursor.execute('''
+    SELECT run_id FROM probe_runs
+    WHERE stage = ? AND finished_at IS NULL AND started_at >= datetime('now', 'localtime', ?)
+    ORDER BY run_id DESC LIMIT 1
+    ''', (stage, f'-{resume_max_age_hours} hours'))
+    row = cursor.fetchone()
+
+    if row:
+        run_id = row[0]
+        cursor.execute('SELECT source_id FROM probe_journal WHERE run_id = ?', (run_id,))
+        done_ids = {source_id for (source_id,) in cursor.fetchall()}
+        logger.info(f"Resuming {stage} run {run_id}, {len(done_ids)} sources already processed.")
+        conn.commit()
+        return run_id, done_ids, True
+
+    # 放弃过期的未完成轮次，只保留轮次记录
+    cursor.execute('''
+    DELETE FROM probe_journal WHERE run_id IN (
+        SELECT run_id FROM probe_runs WHERE stage = ? AND finished_at IS NULL
+    )
+    ''', (stage,))
+    cursor.execute('''
+    UPDATE probe_runs SET finished_at = datetime('now', 'localtime')
+    WHERE stage = ? AND finished_at IS NULL
+    ''', (stage,))
+    cursor.execute('''
+    INSERT INTO probe_runs (stage, started_at) VALUES (?, datetime('now', 'localtime'))
+    ''', (stage,))
+    run_id = cursor.lastrowid
+    conn.commit()
+    logger.info(f"Started {stage} run {run_id}.")
+    return run_id, set(), False
+
+def journal_batch(cursor, run_id, successes, failures):
+    """在写入检测结果的同一事务中记录本批次已处理的直播源"""
+    rows = [(run_id, result["id"], 1) for result in successes]
+    rows += [(run_id, source["id"], 0) for source in failures]
+    cursor.executemany('''
+    INSERT OR REPLACE INTO probe_journal (run_id, source_id, ok, recorded_at)
+    VALUES (?, ?, ?, datetime('now', 'localtime'))
+    ''', rows)
+
+def finish_run(conn, run_id):
+    """标记一轮检测完成，并清理该轮的逐条日志"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    UPDATE probe_runs SET finished_at = datetime('now', 'localtime') WHERE run_id = ?
+    ''', (run_id,))
+    cursor.execute('DELETE FROM probe_journal WHERE run_id = ?', (run_id,))
+    conn.commit()
+    logger.info(f"Run {run_id} finished.")
@@ -31,6 +31,8 @@ FAILED_SOURCES_CLEANUP_DAYS = int(os.getenv('FAILED_SOURCES_CLEANUP_DAYS', confi
 FFMPEG_CHECK_FREQUENCY_MINUTES = int(os.getenv('FFMPEG_CHECK_FREQUENCY_MINUTES', config['scheduler']['ffmpeg_check_frequency_minutes']))
 SEARCH_INTERVAL_HOURS = int(os.getenv('SEARCH_INTERVAL_HOURS', config['scheduler']['search_interval_hours']))  # 获取搜索间隔
 PORT = int(os.getenv('PORT', int(config["network"]["port"])))
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', config['network'].get('server_threads', 16)))  # Waitress 线程数
+MONITOR_MODE = os.getenv('MONITOR_MODE', config['scheduler'].get('monitor_mode', 'batch'))  # batch 为每个周期集中测速一次，daemon 为常驻进程在周期内均匀测速
 
 # 创建任务队列
 task_queue = Queue()
@@ -74,11 +76,13 @@ async def schedule_daily_monitor():
         "db_setup.py",
         "import_playlists.py"
     ]
+    if MONITOR_MODE == 'daemon':
+        monitored_scripts.remove("daily_monitor.py")  # 常驻测速进程一直在运行，不影响其他任务
     
     while True:
         await asyncio.sleep(SCHEDULER_INTERVAL_MINUTES * 60)
         if not await is_process_running(monitored_scripts):
-            await add_task_to_queue(run_subprocess("daily_monitor.py"))
+            await add_daily_monitor_to_queue()
             await add_task_to_queue(run_subprocess("update_emby_guide.py"))
         else:
             logger.info("有其他任务正在运行，跳过 daily_monitor.py 调度")
@@ -94,6 +98,8 @@ async def schedule_ffmpeg_source_checker():
         "db_setup.py",
         "import_playlists.py"
     ]
+    if MONITOR_MODE == 'daemon':
+        monitored_scripts.remove("daily_monitor.py")  # 常驻测速进程一直在运行，不影响其他任务
     
     while True:
         await asyncio.sleep(FFMPEG_CHECK_FREQUENCY_MINUTES * 60)
@@ -112,7 +118,7 @@ async def schedule_search_tasks():
         await add_task_to_queue(run_subprocess("domain_batch_query.py"))
         await add_task_to_queue(run_subprocess("import_playlists.py")) 
         await add_task_to_queue(run_subprocess("ffmpeg_source_checker.py"))
-        await add_task_to_queue(run_subprocess("daily_monitor.py"))
+        await add_daily_monitor_to_queue()
         await add_task_to_queue(run_subprocess("update_emby_guide.py"))
         
 async def run_subprocess(script_name):
@@ -125,6 +131,33 @@ async def run_subprocess(script_name):
     except Exception as e:
         logger.error(f"Failed to run {script_name}: {e}")
 
+async def add_daily_monitor_to_queue():
+    """批量测速模式下把 daily_monitor.py 放入队列，常驻模式下由常驻进程负责测速"""
+    if MONITOR_MODE != 'daemon':
+        await add_task_to_queue(run_subprocess("daily_monitor.py"))
+
+async def start_monitor_daemon():
+    """启动常驻测速进程，并在进程退出时重启"""
+    process = await run_monitor_daemon()
+    if process:
+        asyncio.create_task(monitor_daemon_process(process))
+
+async def run_monitor_daemon():
+    logger.info("Starting rolling monitor daily_monitor.py --daemon...")
+    try:
+        return await asyncio.create_subprocess_exec("python", "daily_monitor.py", "--daemon")
+    except Exception as e:
+        logger.error(f"Error starting rolling monitor: {e}")
+        return None
+
+async def monitor_daemon_process(process):
+    """监控常驻测速进程，如果进程停止则重启"""
+    while True:
+        if process and process.returncode is not None:
+            logger.error("Rolling monitor has stopped. Restarting...")
+            process = await run_monitor_daemon()
+        await asyncio.sleep(60)
+
 async def watch_files():
     """监控文件变化，将检测到的任务加入队列"""
     paths_to_watch = ['data/user_uploaded', 'data/filter_conditions.xlsx']
@@ -135,14 +168,14 @@ async def watch_files():
         await add_task_to_queue(run_subprocess("db_setup.py"))
         await add_task_to_queue(run_subprocess("import_playlists.py"))
         await add_task_to_queue(run_subprocess("ffmpeg_source_checker.py"))
-        await add_task_to_queue(run_subprocess("daily_monitor.py"))
+        await add_daily_monitor_to_queue()
         await add_task_to_queue(run_subprocess("update_emby_guide.py"))
 
 async def run_flask_server():
     """启动 Flask 服务器"""
     logger.info("使用 Waitress 启动 Flask 服务器...")
     try:
-        process = await asyncio.create_subprocess_exec("waitress-serve", "--host", HOST_IP, "--port", str(PORT), "flask_server:app")
+        process = await asyncio.create_subprocess_exec("waitress-serve", "--host", HOST_IP, "--port", str(PORT), "--threads", str(SERVER_THREADS), "flask_server:app")
         logger.info(f"Flask server started successfully on {HOST_IP}:{PORT}.")
         return process
     except Exception as e:
@@ -178,8 +211,11 @@ async def run_initial_tasks():
     await add_task_to_queue(run_subprocess("domain_batch_query.py"))
     await add_task_to_queue(run_subprocess("import_playlists.py"))
     await add_task_to_queue(run_subprocess("ffmpeg_source_checker.py"))
-    await add_task_to_queue(run_subprocess("daily_monitor.py"))
+    await add_daily_monitor_to_queue()
     await add_task_to_queue(run_subprocess("update_emby_guide.py"))
+    if MONITOR_MODE == 'daemon':
+        # 初始化完成、数据库中已有直播源后再启动常驻测速
+        await add_task_to_queue(start_monitor_daemon())
 
 async def main():
     # 启动文件监控任务
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+from logging_config import logger  # 使用外部的日志配置
+
+SNAPSHOT_TABLE = 'filtered_playlists_readonly'
+
+def read_snapshot_version(path):
+    """读取快照文件的版本号（PRAGMA user_version），文件不存在或无法读取时返回 0"""
+    if not os.path.exists(path):
+        return 0
+    try:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
+
+def fsync_directory(directory):
+    """同步目录项，保证 rename 在掉电后仍然有效，不支持的平台直接跳过"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+SNAPSHOT_COLUMNS = 'id, tvg_id, tvg_name, group_title, aliasesname, tvordero, tvg_logor, title, url, latency, resolution, format, download_speed, score, failure_count, last_failed_date'
+
+def publish_snapshot(source_db, snapshot_path, source_table='filtered_playlists'):
+    """把 source_table 发布为只读快照 snapshot_path，返回新版本号
+
+    先在同一目录的临时文件中批量导入数据并建立索引，写入版本号后 fsync，
+    再用 os.replace 原子替换旧快照。读取方始终看到完整且带索引的快照，不会看到清空或写入中的表。
+    """
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    temp_path = os.path.join(directory, f'.{os.path.basename(snapshot_path)}.{os.getpid()}.tmp')
+    version = read_snapshot_version(snapshot_path) + 1
+
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    conn = sqlite3.connect(temp_path)
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')  # 临时文件失败时直接丢弃，不需要回滚日志
+        conn.execute('PRAGMA synchronous = OFF')  # 替换前统一 fsync
+        conn.execute('ATTACH DATABASE ? AS source', (source_db,))
+        conn.execute(f'''
+            CREATE TABLE {SNAPSHOT_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tvg_id TEXT,
+                tvg_name TEXT,
+                group_title TEXT,
+                aliasesname TEXT,
+                tvordero INTEGER,
+                tvg_logor TEXT,
+                title TEXT,
+                url TEXT,
+                latency INTEGER,
+                resolution TEXT,
+                format TEXT,
+                download_speed FLOAT,
+                score FLOAT,
+                failure_count INTEGER DEFAULT 0,
+                last_failed_date TIMESTAMP DEFAULT 0
+            )
+        ''')
+        conn.execute(f'''
+            INSERT INTO {SNAPSHOT_TABLE} ({SNAPSHOT_COLUMNS})
+            SELECT {SNAPSHOT_COLUMNS}
+            FROM source.{source_table}
+        ''')
+        row_count = conn.execute(f'SELECT COUNT(*) FROM {SNAPSHOT_TABLE}').fetchone()[0]
+
+        # 数据导入后再建索引，重定向查询按频道取评分最高的直播源
+        conn.execute(f'CREATE INDEX idx_readonly_channel_score ON {SNAPSHOT_TABLE} (aliasesname, score DESC)')
+        conn.execute('''
+            CREATE TABLE snapshot_meta (
+                version INTEGER NOT NULL,
+                published_at TIMESTAMP NOT NULL,
+                row_count INTEGER NOT NULL
+            )
+        ''')
+        conn.execute("INSERT INTO snapshot_meta (version, published_at, row_count) VALUES (?, datetime('now', 'localtime'), ?)", (version, row_count))
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+        conn.commit()
+        conn.execute('DETACH DATABASE source')
+    except Exception:
+        conn.close()
+        os.remove(temp_path)
+        raise
+    conn.close()
+
+    with open(temp_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(temp_path, snapshot_path)
+    fsync_directory(directory)
+
+    logger.info(f"Published snapshot version {version} with {row_count} sources to {snapshot_path}")
+    return version
+
+def refresh_snapshot(source_db, snapshot_path, ids, source_table='filtered_playlists'):
+    """把 ids 对应的直播源增量同步到已发布的快照，返回新版本号
+
+    在一个事务中删除这些直播源的旧记录，再从 source_table 重新插入仍然存在的记录，
+    同时更新版本号。读取方在事务提交前看到的仍是上一版本。快照不存在时完整发布一次。
+    """
+    if read_snapshot_version(snapshot_path) == 0:
+        return publish_snapshot(source_db, snapshot_path, source_table)
+
+    conn = sqlite3.connect(snapshot_path, timeout=30)
+    try:
+        conn.execute('ATTACH DATABASE ? AS source', (source_db,))
+        with conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS changed_ids (id INTEGER PRIMARY KEY)')
+            conn.execute('DELETE FROM changed_ids')
+            conn.executemany('INSERT OR IGNORE INTO changed_ids (id) VALUES (?)', [(id_,) for id_ in ids])
+            conn.execute(f'DELETE FROM {SNAPSHOT_TABLE} WHERE id IN (SELECT id FROM changed_ids)')
+            conn.execute(f'''
+                INSERT INTO {SNAPSHOT_TABLE} ({SNAPSHOT_COLUMNS})
+                SELECT {SNAPSHOT_COLUMNS}
+                FROM source.{source_table} WHERE id IN (SELECT id FROM changed_ids)
+            ''')
+            row_count = conn.execute(f'SELECT COUNT(*) FROM {SNAPSHOT_TABLE}').fetchone()[0]
+            version = conn.execute('PRAGMA user_version').fetchone()[0] + 1
+            conn.execute("UPDATE snapshot_meta SET version = ?, published_at = datetime('now', 'localtime'), row_count = ?", (version, row_count))
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+        conn.execute('DETACH DATABASE source')
+    finally:
+        conn.close()
+
+    logger.info(f"Refreshed {len(ids)} sources in snapshot version {version} ({row_count} sources) at {snapshot_path}")
+    return version
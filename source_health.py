@@ -0,0 +1,142 @@
+import threading
+import time
+import requests
+from hls_playlist import looks_like_hls
+from logging_config import logger  # 使用外部的日志配置
+
+class SourceHealth:
+    """重定向服务器的直播源健康状态，在两次测速之间快速发现失效的直播源
+
+    主动检查：重定向前对选中的 URL 发起一次短超时的请求，读到数据即视为可用，
+    结果缓存 check_ttl 秒，同一 URL 同时只检查一次。
+    被动反馈：同一客户端刚分配到非 HLS 直播源就在 rerequest_seconds 秒内再次请求同一频道，
+    视为该直播源无法播放。同一 URL 收到 failure_threshold 个不同客户端的反馈后，
+    开启主动检查时立即重新检查，否则直接降级。
+    检查失败的 URL 被降级 demote_seconds 秒，期间排在所有正常直播源之后。
+    """
+
+    def __init__(self, active_check=True, check_ttl=30, check_timeout=2.0,
+                 rerequest_seconds=5, failure_threshold=3, demote_seconds=300):
+        self.active_check = active_check
+        self.check_ttl = check_ttl
+        self.check_timeout = check_timeout
+        self.rerequest_seconds = rerequest_seconds
+        self.failure_threshold = failure_threshold  # 0 表示不使用被动反馈
+        self.demote_seconds = demote_seconds
+        self.checked = {}  # url -> (是否可用, 过期时间)
+        self.in_progress = {}  # url -> threading.Event，正在进行的检查
+        self.demoted = {}  # url -> 降级结束时间
+        self.failures = {}  # url -> 反馈失败的客户端集合
+        self.assigned = {}  # (client, aliasesname) -> [url, 分配时间, 连续快速重复请求次数]
+        self.lock = threading.Lock()
+
+    def is_demoted(self, url, now=None):
+        until = self.demoted.get(url)
+        return until is not None and until > (now or time.monotonic())
+
+    def rank(self, candidates):
+        """去掉已降级的直播源，全部降级时原样返回，由主动检查逐个确认"""
+        now = time.monotonic()
+        healthy = tuple(candidate for candidate in candidates if not self.is_demoted(candidate[0], now))
+        return healthy or candidates
+
+    def demote(self, url, reason):
+        with self.lock:
+            self.mark_demoted(url, time.monotonic())
+        logger.warning(f"Demoted {url} for {self.demote_seconds} s: {reason}")
+
+    def mark_demoted(self, url, now):
+        """在持有 self.lock 时调用"""
+        self.demoted[url] = now + self.demote_seconds
+        self.checked[url] = (False, now + self.check_ttl)
+        self.failures.pop(url, None)
+
+    def record_request(self, client, aliasesname):
+        """记录一次频道请求，客户端刚分配到直播源就重新请求时把该直播源记为一次失败
+
+        client 需要能区分同一出口地址后的不同设备（如地址加 User-Agent），为 None 时不使用被动反馈。
+        只有一次短暂分配后的第一次快速重复请求才算失败，持续按固定间隔重复请求
+        （通过重定向地址刷新播放列表的播放器）不计入；HLS 直播源总是会被重复请求，不使用被动反馈。
+        同一直播源需要来自 failure_threshold 个不同客户端的反馈。
+        """
+        if self.failure_threshold <= 0 or client is None:
+            return
+        now = time.monotonic()
+        key = (client, aliasesname)
+        with self.lock:
+            previous = self.assigned.get(key)
+            if previous is None:
+                return
+            url, assigned_at, streak = previous
+            if now - assigned_at > self.rerequest_seconds:
+                previous[2] = 0
+                return
+            previous[2] = streak + 1
+            if streak > 0 or looks_like_hls(url):
+                return
+            reporters = self.failures.setdefault(url, set())
+            reporters.add(client)
+            if len(reporters) < self.failure_threshold:
+                return
+            count = len(reporters)
+            self.failures.pop(url, None)
+            if self.active_check:
+                self.checked.pop(url, None)  # 下次分配时重新检查
+                return
+        self.demote(url, f"quick re-requests from {count} clients")
+
+    def record_assignment(self, client, aliasesname, url):
+        if self.failure_threshold <= 0 or client is None:
+            return
+        now = time.monotonic()
+        key = (client, aliasesname)
+        with self.lock:
+            previous = self.assigned.get(key)
+            self.assigned[key] = [url, now, previous[2] if previous is not None else 0]
+            # 定期清理过期的分配记录
+            if len(self.assigned) > 10000:
+                self.assigned = {key: value for key, value in self.assigned.items() if now - value[1] <= self.rerequest_seconds}
+
+    def check(self, url):
+        """返回 url 当前是否可用，关闭主动检查时总是返回 True"""
+        if not self.active_check:
+            return True
+
+        while True:
+            with self.lock:
+                cached = self.checked.get(url)
+                if cached is not None and cached[1] > time.monotonic():
+                    return cached[0]
+                event = self.in_progress.get(url)
+                if event is None:
+                    event = self.in_progress[url] = threading.Event()
+                    break
+            # 其他线程正在检查同一 URL，等待它的结果
+            event.wait(self.check_timeout * 2)
+
+        healthy = False
+        try:
+            healthy = self.probe(url)
+        finally:
+            # 结果写入缓存和结束检查在同一个锁内完成，被唤醒的等待者总能读到结果，不会重复检查
+            with self.lock:
+                if healthy:
+                    self.checked[url] = (True, time.monotonic() + self.check_ttl)
+                    self.demoted.pop(url, None)
+                else:
+                    self.mark_demoted(url, time.monotonic())
+                self.in_progress.pop(url, None)
+            event.set()
+
+        if not healthy:
+            logger.warning(f"Demoted {url} for {self.demote_seconds} s: health check failed")
+        return healthy
+
+    def probe(self, url):
+        try:
+            with requests.get(url, stream=True, timeout=self.check_timeout) as response:
+                if response.status_code >= 400:
+                    return False
+                return bool(next(response.iter_content(1024), b''))
+        except (requests.RequestException, OSError):
+            return False
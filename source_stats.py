@@ -0,0 +1,160 @@
+import math
+import numpy as np
+import pandas as pd
+from logging_config import logger  # 使用外部的日志配置
+from calculate_score import initialize_stability_and_success_rate
+
+def setup_stats_tables(cursor):
+    """创建测速历史表和按直播源汇总的 EWMA 统计表"""
+    # 只追加的测速历史，超过保留期的原始记录按天合并，samples 为合并的测速次数
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS measurements (
+        source_id INTEGER NOT NULL,
+        measured_at TIMESTAMP NOT NULL,
+        latency FLOAT,
+        download_speed FLOAT,
+        ok FLOAT NOT NULL,
+        samples INTEGER NOT NULL DEFAULT 1,
+        downsampled INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_measurements_source ON measurements (source_id, measured_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_measurements_downsample ON measurements (downsampled, measured_at)')
+
+    # 每个直播源的 EWMA 统计，每轮测速后增量更新，评分只依赖这张表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS source_stats (
+        source_id INTEGER PRIMARY KEY,
+        ewma_latency FLOAT,
+        ewma_speed FLOAT,
+        speed_variance FLOAT NOT NULL DEFAULT 0,
+        success_rate FLOAT NOT NULL,
+        samples INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP
+    )
+    ''')
+
+class SourceStats:
+    """以 filtered_playlists.id 为键的测速统计
+
+    延迟和下载速度使用指数加权移动平均（EWMA），成功率是成功与否的 EWMA，
+    稳定性由下载速度的 EWMA 方差换算（1 - 变异系数）。统计在内存中增量更新，
+    测速记录和统计在调用 flush 后与检测结果写入同一个事务。
+    """
+
+    def __init__(self, cursor, alpha):
+        self.cursor = cursor
+        self.alpha = alpha
+        self.pending_measurements = []
+        self.dirty = set()
+
+        setup_stats_tables(cursor)
+        cursor.execute('''
+        SELECT source_id, ewma_latency, ewma_speed, speed_variance, success_rate, samples FROM source_stats
+        ''')
+        self.entries = {row[0]: list(row[1:]) for row in cursor.fetchall()}
+        logger.info(f"Loaded measurement statistics for {len(self.entries)} sources.")
+
+    def observe(self, source_id, latency, download_speed, ok):
+        """记录一次测速，失败时 latency 和 download_speed 为 None"""
+        _, initial_success_rate = initialize_stability_and_success_rate()
+        entry = self.entries.setdefault(source_id, [None, None, 0.0, initial_success_rate, 0])
+        alpha = self.alpha
+
+        if ok:
+            entry[0] = latency if entry[0] is None else entry[0] + alpha * (latency - entry[0])
+            if entry[1] is None:
+                entry[1] = download_speed
+            else:
+                # 增量更新 EWMA 均值和方差
+                diff = download_speed - entry[1]
+                increment = alpha * diff
+                entry[1] += increment
+                entry[2] = (1 - alpha) * (entry[2] + diff * increment)
+        entry[3] += alpha * ((1.0 if ok else 0.0) - entry[3])
+        entry[4] += 1
+
+        self.pending_measurements.append((source_id, latency, download_speed, 1 if ok else 0))
+        self.dirty.add(source_id)
+
+    def get(self, source_id):
+        """返回 (延迟毫秒, 下载速度 KB/s, 稳定性, 成功率)，没有成功测速记录时延迟和速度为 None"""
+        initial_stability, initial_success_rate = initialize_stability_and_success_rate()
+        entry = self.entries.get(source_id)
+        if entry is None:
+            return None, None, initial_stability, initial_success_rate
+
+        latency, speed, variance, success_rate, samples = entry
+        if samples < 2 or not speed:
+            stability = initial_stability
+        else:
+            stability = max(0.0, 1 - math.sqrt(variance) / speed)
+        return latency, speed, stability, success_rate
+
+    def flush(self):
+        if self.pending_measurements:
+            self.cursor.executemany('''
+            INSERT INTO measurements (source_id, measured_at, latency, download_speed, ok)
+            VALUES (?, datetime('now', 'localtime'), ?, ?, ?)
+            ''', self.pending_measurements)
+            self.pending_measurements = []
+        if self.dirty:
+            self.cursor.executemany('''
+            INSERT OR REPLACE INTO source_stats (source_id, ewma_latency, ewma_speed, speed_variance, success_rate, samples, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))
+            ''', [(source_id, *self.entries[source_id]) for source_id in self.dirty])
+            self.dirty = set()
+
+def downsample_measurements(conn, raw_days, retention_days):
+    """把 raw_days 天之前的原始测速记录按直播源和日期合并为一条，删除超过 retention_days 天的记录
+
+    只处理截止日期之前的完整日期，每天的记录只会被合并一次。
+    """
+    cutoff = f'-{raw_days} days'
+    cursor = conn.cursor()
+    with conn:
+        cursor.execute('''
+        INSERT INTO measurements (source_id, measured_at, latency, download_speed, ok, samples, downsampled)
+        SELECT source_id, date(measured_at),
+               SUM(latency * samples) * 1.0 / SUM(CASE WHEN latency IS NOT NULL THEN samples END),
+               SUM(download_speed * samples) * 1.0 / SUM(CASE WHEN download_speed IS NOT NULL THEN samples END),
+               SUM(ok * samples) * 1.0 / SUM(samples),
+               SUM(samples), 1
+        FROM measurements
+        WHERE downsampled = 0 AND measured_at < date('now', 'localtime', ?)
+        GROUP BY source_id, date(measured_at)
+        ''', (cutoff,))
+        merged = cursor.rowcount
+        cursor.execute('''
+        DELETE FROM measurements WHERE downsampled = 0 AND measured_at < date('now', 'localtime', ?)
+        ''', (cutoff,))
+        cursor.execute('''
+        DELETE FROM measurements WHERE measured_at < date('now', 'localtime', ?)
+        ''', (f'-{retention_days} days',))
+        expired = cursor.rowcount
+        # 已不在 filtered_playlists 中的直播源不再需要统计
+        cursor.execute('''
+        DELETE FROM source_stats WHERE source_id NOT IN (SELECT id FROM filtered_playlists)
+        ''')
+    if merged or expired:
+        logger.info(f"Downsampled measurements into {merged} daily rows, removed {expired} expired rows.")
+
+def load_score_inputs(conn, table='filtered_playlists'):
+    """读取 table 中每个直播源的评分输入，返回包含 id、resolution、format、latency（毫秒）、
+    download_speed（KB/s）、stability、success_rate 列的 DataFrame，没有统计的直播源使用表中的最近一次测速"""
+    setup_stats_tables(conn.cursor())
+    df = pd.read_sql_query(f'''
+    SELECT t.id, t.resolution, t.format,
+           COALESCE(s.ewma_latency, t.latency) AS latency,
+           COALESCE(s.ewma_speed, t.download_speed) AS download_speed,
+           s.speed_variance, s.success_rate, s.samples
+    FROM {table} t LEFT JOIN source_stats s ON s.source_id = t.id
+    ''', conn)
+
+    initial_stability, initial_success_rate = initialize_stability_and_success_rate()
+    speed = pd.to_numeric(df["download_speed"], errors='coerce')
+    variance = pd.to_numeric(df["speed_variance"], errors='coerce').fillna(0)
+    has_history = (df["samples"].fillna(0) >= 2) & (speed > 0)
+    df["stability"] = np.where(has_history, np.maximum(0.0, 1 - np.sqrt(variance) / speed.where(speed > 0, 1)), initial_stability)
+    df["success_rate"] = df["success_rate"].fillna(initial_success_rate)
+    return df.drop(columns=["speed_variance", "samples"])
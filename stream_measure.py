@@ -0,0 +1,67 @@
+import time
+import asyncio
+from hls_playlist import looks_like_hls, is_playlist, parse_playlist, choose_variant
+
+READ_CHUNK_SIZE = 64 * 1024
+HLS_MEASURE_SEGMENTS = 3  # HLS 测速从最新的几个切片中依次下载
+
+async def read_until_done(response, sampler, total):
+    """持续读取响应内容并交给采样器，直到吞吐稳定、达到最长采样时间或响应结束，返回累计字节数"""
+    while not sampler.done():
+        try:
+            chunk = await asyncio.wait_for(response.content.read(READ_CHUNK_SIZE), timeout=sampler.interval)
+        except asyncio.TimeoutError:
+            sampler.update(total)  # 没有数据到达也记录一次，停顿会拉低吞吐估计
+            continue
+        if not chunk:
+            break
+        total += len(chunk)
+        sampler.update(total)
+    return total
+
+async def measure_hls(session, text, url, sampler, timeout):
+    """依次下载 HLS 最新的几个切片测速"""
+    playlist = parse_playlist(text, url)
+    if playlist["is_master"]:
+        variant = choose_variant(playlist["variants"])
+        if variant is None:
+            return
+        async with session.get(variant["uri"], timeout=timeout) as response:
+            if response.status != 200:
+                return
+            playlist = parse_playlist(await response.text(errors='ignore'), str(response.url))
+
+    total = 0
+    for segment in playlist["segments"][-HLS_MEASURE_SEGMENTS:]:
+        if sampler.done():
+            break
+        async with session.get(segment["uri"], timeout=timeout) as response:
+            if response.status not in (200, 206):
+                break
+            total = await read_until_done(response, sampler, total)
+
+async def measure_stream(session, url, sampler, timeout):
+    """用一个 GET 请求同时测量延迟和下载速度，不启动 ffmpeg、不解码
+
+    首字节时间作为延迟，之后的下载量交给 sampler 估计下载速度；
+    HLS 源以播放列表的首字节时间作为延迟，下载最新的切片测速。
+    返回 (延迟毫秒, 下载速度 KB/s)，响应状态异常时延迟为 None。连接错误和超时由调用方处理。
+    """
+    start_time = time.monotonic()
+    async with session.get(url, timeout=timeout) as response:
+        if response.status != 200:
+            return None, 0
+
+        first_chunk = await response.content.read(READ_CHUNK_SIZE)
+        latency = int((time.monotonic() - start_time) * 1000)  # 转换为毫秒并保留整数
+        if not first_chunk:
+            return latency, 0
+
+        if looks_like_hls(url, response.headers.get('Content-Type', '')) or is_playlist(first_chunk[:64]):
+            text = (first_chunk + await response.read()).decode('utf-8', errors='ignore')
+            await measure_hls(session, text, str(response.url), sampler, timeout)
+        else:
+            sampler.update(len(first_chunk))
+            await read_until_done(response, sampler, len(first_chunk))
+
+    return latency, sampler.speed()
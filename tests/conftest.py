@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 项目模块为顶层模块，导入时从当前目录读取 config.json
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
@@ -0,0 +1,47 @@
+import asyncio
+import ffmpeg_source_checker
+
+def make_source(source_id, aliasesname, url):
+    return {"id": source_id, "aliasesname": aliasesname, "url": url, "failure_count": 0, "resolution": None}
+
+def run_probes(monkeypatch, sources, healthy_urls, target):
+    probed = []
+
+    async def fake_test_stream(source, session, ffprobe_semaphore, probe_cache, host_health):
+        probed.append(source["id"])
+        await asyncio.sleep(0.01)
+        return {"url": source["url"]}
+
+    monkeypatch.setattr(ffmpeg_source_checker, "test_stream", fake_test_stream)
+    monkeypatch.setattr(ffmpeg_source_checker, "CHANNEL_TARGET_SOURCES", target)
+    results = []
+    asyncio.run(ffmpeg_source_checker.probe_sources(sources, None, lambda source, result: results.append(source["id"]), healthy_urls))
+    return probed, results
+
+def test_satisfied_channels_stop_probing_on_distinct_hosts(monkeypatch):
+    sources = [
+        make_source(channel * 50 + i, f"ch{channel}", f"http://host{channel}-{i}.example/live.ts")
+        for channel in range(10) for i in range(50)
+    ]
+    healthy_urls = {}
+    probed, results = run_probes(monkeypatch, sources, healthy_urls, target=2)
+    assert len(probed) == 20
+    assert sorted(probed) == sorted(results)
+    assert all(len(urls) == 2 for urls in healthy_urls.values())
+
+def test_duplicate_urls_count_once(monkeypatch):
+    sources = [
+        make_source(1, "ch", "http://a.example/live.ts"),
+        make_source(2, "ch", "http://a.example/live.ts"),
+        make_source(3, "ch", "http://b.example/live.ts"),
+        make_source(4, "ch", "http://c.example/live.ts"),
+    ]
+    healthy_urls = {}
+    probed, _ = run_probes(monkeypatch, sources, healthy_urls, target=2)
+    assert sorted(probed) == [1, 2, 3]
+    assert healthy_urls == {"ch": {"http://a.example/live.ts", "http://b.example/live.ts"}}
+
+def test_existing_healthy_urls_skip_channel(monkeypatch):
+    sources = [make_source(i, "ch", f"http://host{i}.example/live.ts") for i in range(5)]
+    probed, _ = run_probes(monkeypatch, sources, {"ch": {"http://x.example/1", "http://x.example/2"}}, target=2)
+    assert probed == []
@@ -0,0 +1,34 @@
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from hls_playlist import playlist_age, STALE_TARGET_DURATIONS, MIN_STALE_SECONDS
+
+def media_playlist(program_date_time, duration=6):
+    return {"segments": [{"uri": "http://example.com/1.ts", "duration": duration, "program_date_time": program_date_time}]}
+
+def pdt(delta):
+    return (datetime.now(timezone.utc) - delta).isoformat()
+
+def last_modified(seconds_ago):
+    return {'Last-Modified': formatdate(time.time() - seconds_ago, usegmt=True)}
+
+def test_fresh_playlist():
+    assert playlist_age(media_playlist(pdt(timedelta(seconds=20))), {}) < MIN_STALE_SECONDS
+
+def test_playlist_frozen_whole_hours_is_stale():
+    for hours in (2, 5):
+        age = playlist_age(media_playlist(pdt(timedelta(hours=hours))), {})
+        assert age is not None and age > max(6 * STALE_TARGET_DURATIONS, MIN_STALE_SECONDS)
+
+def test_whole_hour_offset_with_fresh_last_modified_is_live():
+    age = playlist_age(media_playlist(pdt(timedelta(hours=8))), last_modified(3))
+    assert age is not None and age < MIN_STALE_SECONDS
+
+def test_pdt_without_time_zone_is_ignored():
+    naive = (datetime.now() - timedelta(hours=3)).isoformat()
+    assert playlist_age(media_playlist(naive), {}) is None
+    assert playlist_age(media_playlist(naive), last_modified(10)) < MIN_STALE_SECONDS
+
+def test_skewed_pdt_is_ignored():
+    assert playlist_age(media_playlist(pdt(timedelta(hours=-3))), {}) is None
+    assert playlist_age(media_playlist(pdt(timedelta(days=3))), {}) is None
@@ -0,0 +1,70 @@
+import time
+from collections import deque
+
+CONVERGENCE_SAMPLES = 4  # 连续这么多个吞吐估计都在容差内视为稳定
+
+class ThroughputSampler:
+    """自适应测速窗口
+
+    收到第一个字节时开始计时，按 interval 记录累计字节数。前 warmup 秒的启动突发不计入，
+    之后最近 CONVERGENCE_SAMPLES 个吞吐估计的极差不超过均值的 tolerance 时提前结束，
+    最长采样 max_duration 秒。
+    """
+
+    def __init__(self, max_duration, interval=0.25, tolerance=0.1, warmup=1.0, min_duration=1.0):
+        self.max_duration = max_duration
+        self.interval = interval
+        self.tolerance = tolerance
+        self.warmup = warmup
+        self.min_duration = min_duration
+        self.start_time = None
+        self.now = None
+        self.total = 0
+        self.baseline = None  # 启动阶段结束时的 (时间, 累计字节数)
+        self.next_sample = None
+        self.estimates = deque(maxlen=CONVERGENCE_SAMPLES)
+
+    def update(self, total_bytes, now=None):
+        """记录当前累计字节数，收到第一个字节时开始计时"""
+        now = time.monotonic() if now is None else now
+        if self.start_time is None:
+            if total_bytes <= 0:
+                return
+            self.start_time = now
+        self.now = now
+        self.total = total_bytes
+
+        if now - self.start_time < self.warmup:
+            return
+        if self.baseline is None:
+            self.baseline = (now, total_bytes)
+            self.next_sample = now + self.interval
+            return
+        if now >= self.next_sample:
+            self.next_sample = now + self.interval
+            self.estimates.append(self.rate())
+
+    def elapsed(self):
+        return self.now - self.start_time if self.start_time is not None else 0.0
+
+    def rate(self):
+        """当前的吞吐估计（字节/秒），启动阶段未结束时使用全部数据"""
+        if self.baseline is not None and self.now - self.baseline[0] > 0:
+            return (self.total - self.baseline[1]) / (self.now - self.baseline[0])
+        return self.total / max(self.elapsed(), 0.5)  # 设置最小值为0.5秒
+
+    def converged(self):
+        if len(self.estimates) < CONVERGENCE_SAMPLES or self.now - self.baseline[0] < self.min_duration:
+            return False
+        mean = sum(self.estimates) / len(self.estimates)
+        return mean > 0 and max(self.estimates) - min(self.estimates) <= self.tolerance * mean
+
+    def done(self):
+        """吞吐估计已稳定或达到最长采样时间"""
+        if self.start_time is None:
+            return False
+        return time.monotonic() - self.start_time >= self.max_duration or self.converged()
+
+    def speed(self):
+        """下载速度（KB/s）"""
+        return round(self.rate() / 1024)
@@ -0,0 +1,319 @@
+"""MPEG-TS 头部解析
+
+从直播流开头的几百 KB 数据中解析 PAT/PMT 找到第一个视频流，再从视频 ES 中解析
+H.264/HEVC 的 SPS 或 MPEG-2 的序列头，得到视频编码和分辨率，用于替代 ffprobe 的快速检测。
+解析不出结果时返回 None，由调用方回退到 ffprobe。
+"""
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+# PMT 中的 stream_type 到 ffprobe codec_name 的映射
+VIDEO_STREAM_TYPES = {
+    0x01: "mpeg1video",
+    0x02: "mpeg2video",
+    0x10: "mpeg4",
+    0x1B: "h264",
+    0x24: "hevc",
+    0x42: "cavs",
+    0xD2: "avs2",
+}
+
+# 只有这些编码可以在进程内解析出分辨率
+PARSABLE_CODECS = ("h264", "hevc", "mpeg1video", "mpeg2video")
+
+# H.264 中带有 chroma_format_idc 等字段的 profile
+H264_HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+# 视频 ES 最多收集的字节数，SPS 位于关键帧之前，通常在最开始的几 KB 内
+MAX_ES_BYTES = 512 * 1024
+
+class BitReader:
+    """按位读取 RBSP 数据，支持指数哥伦布编码"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def u(self, bits):
+        value = 0
+        for _ in range(bits):
+            byte = self.data[self.pos >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def skip(self, bits):
+        self.pos += bits
+        if self.pos > len(self.data) * 8:
+            raise IndexError("read past end of RBSP")
+
+    def ue(self):
+        leading_zeros = 0
+        while self.u(1) == 0:
+            leading_zeros += 1
+            if leading_zeros > 31:
+                raise ValueError("invalid exp-golomb code")
+        return (1 << leading_zeros) - 1 + self.u(leading_zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+def find_sync_offset(data):
+    """找到连续三个 TS 包同步字节的位置，找不到时返回 -1"""
+    limit = min(len(data) - 2 * TS_PACKET_SIZE, TS_PACKET_SIZE)
+    for offset in range(max(limit, 0)):
+        if (data[offset] == TS_SYNC_BYTE
+                and data[offset + TS_PACKET_SIZE] == TS_SYNC_BYTE
+                and data[offset + 2 * TS_PACKET_SIZE] == TS_SYNC_BYTE):
+            return offset
+    return -1
+
+def iter_ts_packets(data):
+    """依次返回 (pid, payload_unit_start, payload)"""
+    offset = find_sync_offset(data)
+    if offset < 0:
+        return
+    view = memoryview(data)
+    while offset + TS_PACKET_SIZE <= len(data):
+        packet = view[offset:offset + TS_PACKET_SIZE]
+        offset += TS_PACKET_SIZE
+        if packet[0] != TS_SYNC_BYTE:
+            # 同步丢失后重新寻找同步位置
+            resync = find_sync_offset(data[offset - TS_PACKET_SIZE + 1:])
+            if resync < 0:
+                return
+            offset = offset - TS_PACKET_SIZE + 1 + resync
+            continue
+
+        payload_unit_start = bool(packet[1] & 0x40)
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        adaptation_field_control = (packet[3] >> 4) & 0x03
+        if not adaptation_field_control & 0x01:
+            continue  # 没有负载
+
+        start = 4
+        if adaptation_field_control & 0x02:
+            start += 1 + packet[4]
+        if start >= TS_PACKET_SIZE:
+            continue
+        yield pid, payload_unit_start, packet[start:]
+
+def read_section(payload):
+    """从 PSI 负载中取出完整的 section，返回 (table_id, section 字节) 或 None"""
+    pointer = payload[0]
+    section = bytes(payload[1 + pointer:])
+    if len(section) < 3:
+        return None
+    section_length = ((section[1] & 0x0F) << 8) | section[2]
+    if len(section) < 3 + section_length:
+        return None  # section 跨包，极少见，交给 ffprobe 处理
+    return section[0], section[:3 + section_length]
+
+def parse_pat(section):
+    """返回 PAT 中第一个节目的 PMT PID"""
+    end = len(section) - 4  # 去掉 CRC
+    for offset in range(8, end - 3, 4):
+        program_number = (section[offset] << 8) | section[offset + 1]
+        pid = ((section[offset + 2] & 0x1F) << 8) | section[offset + 3]
+        if program_number != 0:
+            return pid
+    return None
+
+def parse_pmt(section):
+    """返回 PMT 中第一个视频流的 (pid, codec)"""
+    program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+    offset = 12 + program_info_length
+    end = len(section) - 4
+    while offset + 5 <= end:
+        stream_type = section[offset]
+        pid = ((section[offset + 1] & 0x1F) << 8) | section[offset + 2]
+        es_info_length = ((section[offset + 3] & 0x0F) << 8) | section[offset + 4]
+        if stream_type in VIDEO_STREAM_TYPES:
+            return pid, VIDEO_STREAM_TYPES[stream_type]
+        offset += 5 + es_info_length
+    return None
+
+def strip_pes_header(payload):
+    """去掉 PES 头，返回 ES 数据"""
+    if len(payload) < 9 or payload[0] != 0 or payload[1] != 0 or payload[2] != 1:
+        return b""
+    return payload[9 + payload[8]:]
+
+def remove_emulation_prevention(data):
+    """去掉 NAL 中的防竞争字节 0x03，得到 RBSP"""
+    return data.replace(b"\x00\x00\x03", b"\x00\x00")
+
+def iter_nal_units(es):
+    """按起始码切分 Annex B 格式的 NAL 单元"""
+    positions = []
+    index = es.find(b"\x00\x00\x01")
+    while index >= 0:
+        positions.append(index + 3)
+        index = es.find(b"\x00\x00\x01", index + 3)
+    for i, start in enumerate(positions):
+        end = positions[i + 1] - 3 if i + 1 < len(positions) else len(es)
+        yield es[start:end].rstrip(b"\x00")
+
+def skip_h264_scaling_list(reader, size):
+    last_scale = next_scale = 8
+    for _ in range(size):
+        if next_scale != 0:
+            next_scale = (last_scale + reader.se() + 256) % 256
+        if next_scale != 0:
+            last_scale = next_scale
+
+def parse_h264_sps(nal):
+    """解析 H.264 SPS，返回视频高度"""
+    reader = BitReader(remove_emulation_prevention(nal[1:]))
+    profile_idc = reader.u(8)
+    reader.skip(16)  # constraint_set flags + level_idc
+    reader.ue()  # seq_parameter_set_id
+
+    chroma_format_idc = 1
+    separate_colour_plane = 0
+    if profile_idc in H264_HIGH_PROFILES:
+        chroma_format_idc = reader.ue()
+        if chroma_format_idc == 3:
+            separate_colour_plane = reader.u(1)
+        reader.ue()  # bit_depth_luma_minus8
+        reader.ue()  # bit_depth_chroma_minus8
+        reader.skip(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.u(1):  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if reader.u(1):
+                    skip_h264_scaling_list(reader, 16 if i < 6 else 64)
+
+    reader.ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.ue()
+    if pic_order_cnt_type == 0:
+        reader.ue()
+    elif pic_order_cnt_type == 1:
+        reader.skip(1)
+        reader.se()
+        reader.se()
+        for _ in range(reader.ue()):
+            reader.se()
+    reader.ue()  # max_num_ref_frames
+    reader.skip(1)  # gaps_in_frame_num_value_allowed_flag
+    reader.ue()  # pic_width_in_mbs_minus1
+    pic_height_in_map_units = reader.ue() + 1
+    frame_mbs_only = reader.u(1)
+    if not frame_mbs_only:
+        reader.skip(1)  # mb_adaptive_frame_field_flag
+    reader.skip(1)  # direct_8x8_inference_flag
+
+    height = (2 - frame_mbs_only) * pic_height_in_map_units * 16
+    if reader.u(1):  # frame_cropping_flag
+        reader.ue()
+        reader.ue()
+        crop_top = reader.ue()
+        crop_bottom = reader.ue()
+        chroma_array_type = 0 if separate_colour_plane else chroma_format_idc
+        sub_height_c = 2 if chroma_array_type == 1 else 1
+        crop_unit_y = (2 - frame_mbs_only) * (sub_height_c if chroma_array_type else 1)
+        height -= crop_unit_y * (crop_top + crop_bottom)
+    return height
+
+def skip_hevc_profile_tier_level(reader, max_sub_layers_minus1):
+    reader.skip(96)  # general_profile_space ... general_level_idc
+    sub_layer_flags = [(reader.u(1), reader.u(1)) for _ in range(max_sub_layers_minus1)]
+    if max_sub_layers_minus1 > 0:
+        reader.skip(2 * (8 - max_sub_layers_minus1))
+    for profile_present, level_present in sub_layer_flags:
+        if profile_present:
+            reader.skip(88)
+        if level_present:
+            reader.skip(8)
+
+def parse_hevc_sps(nal):
+    """解析 HEVC SPS，返回视频高度"""
+    reader = BitReader(remove_emulation_prevention(nal[2:]))
+    reader.skip(4)  # sps_video_parameter_set_id
+    max_sub_layers_minus1 = reader.u(3)
+    reader.skip(1)  # sps_temporal_id_nesting_flag
+    skip_hevc_profile_tier_level(reader, max_sub_layers_minus1)
+    reader.ue()  # sps_seq_parameter_set_id
+    chroma_format_idc = reader.ue()
+    if chroma_format_idc == 3:
+        reader.skip(1)  # separate_colour_plane_flag
+    reader.ue()  # pic_width_in_luma_samples
+    height = reader.ue()
+    if reader.u(1):  # conformance_window_flag
+        reader.ue()
+        reader.ue()
+        crop_top = reader.ue()
+        crop_bottom = reader.ue()
+        sub_height_c = 2 if chroma_format_idc == 1 else 1
+        height -= sub_height_c * (crop_top + crop_bottom)
+    return height
+
+def parse_mpeg2_sequence_header(es):
+    """解析 MPEG-1/2 序列头，返回视频高度"""
+    index = es.find(b"\x00\x00\x01\xb3")
+    if index < 0 or index + 7 > len(es):
+        return None
+    return ((es[index + 5] & 0x0F) << 8) | es[index + 6]
+
+def parse_video_height(codec, es):
+    if codec in ("mpeg1video", "mpeg2video"):
+        return parse_mpeg2_sequence_header(es)
+
+    for nal in iter_nal_units(es):
+        if not nal:
+            continue
+        try:
+            if codec == "h264" and nal[0] & 0x1F == 7:
+                return parse_h264_sps(nal)
+            if codec == "hevc" and (nal[0] >> 1) & 0x3F == 33:
+                return parse_hevc_sps(nal)
+        except (IndexError, ValueError):
+            return None
+    return None
+
+def parse_ts_video_info(data):
+    """解析 TS 数据中第一个视频流的 (height, codec)，无法解析时返回 None"""
+    pmt_pid = None
+    video_pid = None
+    codec = None
+    es = bytearray()
+
+    for pid, payload_unit_start, payload in iter_ts_packets(data):
+        if video_pid is None:
+            if not payload_unit_start:
+                continue
+            if pid == 0 and pmt_pid is None:
+                section = read_section(payload)
+                if section and section[0] == 0x00:
+                    pmt_pid = parse_pat(section[1])
+            elif pid == pmt_pid:
+                section = read_section(payload)
+                if section and section[0] == 0x02:
+                    stream = parse_pmt(section[1])
+                    if stream is None:
+                        return None
+                    video_pid, codec = stream
+                    if codec not in PARSABLE_CODECS:
+                        return None
+            continue
+
+        if pid != video_pid:
+            continue
+        if payload_unit_start:
+            if es:
+                # 每收到一个完整的 PES 尝试解析一次
+                height = parse_video_height(codec, bytes(es))
+                if height:
+                    return height, codec
+            es.extend(strip_pes_header(payload))
+        elif es:
+            es.extend(payload)
+        if len(es) > MAX_ES_BYTES:
+            break
+
+    if es:
+        height = parse_video_height(codec, bytes(es))
+        if height:
+            return height, codec
+    return None
@@ -0,0 +1,133 @@
+import threading
+import time
+import requests
+import urllib3
+from hls_playlist import looks_like_hls
+from logging_config import logger  # 使用外部的日志配置
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+SYNC_PACKETS = 3  # 连续几个包都以同步字节开头才认为找到了包边界
+READ_PACKETS = 348  # 每次读取的包数，约 64KB
+
+def find_sync(data, length):
+    """返回 data[:length] 中第一个连续 SYNC_PACKETS 个 TS 包边界的偏移，找不到时返回 -1"""
+    offset = data.find(SYNC_BYTE, 0, length)
+    while offset != -1 and offset + (SYNC_PACKETS - 1) * TS_PACKET_SIZE < length:
+        if all(data[offset + i * TS_PACKET_SIZE] == SYNC_BYTE for i in range(1, SYNC_PACKETS)):
+            return offset
+        offset = data.find(SYNC_BYTE, offset + 1, length)
+    return -1
+
+def has_ts_sources(candidates):
+    """频道中是否有可以按字节流中继的非 HLS 直播源"""
+    return any(not looks_like_hls(url) for url, _ in candidates)
+
+class TsRelay:
+    """MPEG-TS 流中继：为每个观众从评分最高的直播源拉流并转发，上游失效时无缝切换到下一个直播源
+
+    上游连续 stall_seconds 秒的吞吐低于 min_speed KB/s、读取超时或连接断开时，
+    调用 on_upstream_failure(url, reason) 并切换到排名下一位的直播源，客户端连接保持不断。
+    切换后从新上游的第一个 TS 包边界开始转发，只向客户端发送完整的 188 字节包。
+    每个观众使用一块预分配的缓冲区，通过 memoryview 写入上游数据、对齐包边界，
+    不足一包的尾部在缓冲区内移到开头，不拼接新的 bytes，转发时只复制一次完整包交给 WSGI 服务器。
+
+    每个转发占用 WSGI 服务器的一个线程直到客户端断开，同时转发的流不超过 max_streams 个，
+    调用方在开始转发前 acquire，响应关闭时 release，名额用完时改为普通重定向。
+
+    candidates(aliasesname) 返回频道按优先级排列的直播源 URL 列表。
+    """
+
+    def __init__(self, candidates, on_upstream_failure, min_speed=64, stall_seconds=5, connect_timeout=5, max_rounds=2, max_streams=8):
+        self.candidates = candidates
+        self.max_streams = max_streams
+        self.slots = threading.BoundedSemaphore(max_streams)
+        self.on_upstream_failure = on_upstream_failure
+        self.min_speed = min_speed
+        self.stall_seconds = stall_seconds
+        self.connect_timeout = connect_timeout
+        self.max_rounds = max_rounds  # 所有直播源都失败后重新从头尝试的轮数
+
+    def acquire(self):
+        """占用一个转发名额，名额已满时返回 False"""
+        return self.slots.acquire(blocking=False)
+
+    def release(self):
+        self.slots.release()
+
+    def stream(self, aliasesname):
+        """生成转发给客户端的 TS 数据，所有直播源都失败后结束"""
+        buffer = bytearray(TS_PACKET_SIZE * READ_PACKETS)
+        view = memoryview(buffer)
+        for _ in range(self.max_rounds):
+            urls = self.candidates(aliasesname)
+            if not urls:
+                break
+            for url in urls:
+                yield from self.forward(aliasesname, url, buffer, view)
+        logger.error(f"All relay sources for {aliasesname} failed, closing stream.")
+
+    def forward(self, aliasesname, url, buffer, view):
+        """从 url 转发完整的 TS 包，上游失效时返回"""
+        try:
+            response = requests.get(url, stream=True, timeout=(self.connect_timeout, self.stall_seconds))
+        except requests.RequestException as e:
+            self.on_upstream_failure(url, f"relay connect failed: {e}")
+            return
+        try:
+            if response.status_code != 200:
+                self.on_upstream_failure(url, f"relay got HTTP {response.status_code}")
+                return
+
+            logger.info(f"Relaying {aliasesname} from {url}")
+            raw = response.raw
+            # read1 最多等待一次网络读取，上游变慢时能及时检查吞吐；urllib3 1.x 没有 read1，改用 read
+            read = getattr(raw, 'read1', None) or raw.read
+            pending = 0  # 缓冲区中尚未转发的字节数
+            aligned = False
+            window_start = time.monotonic()
+            window_bytes = 0
+
+            while True:
+                try:
+                    chunk = read(len(buffer) - pending)
+                except (urllib3.exceptions.HTTPError, requests.RequestException, OSError) as e:
+                    self.on_upstream_failure(url, f"relay read failed: {e}")
+                    return
+                if not chunk:
+                    self.on_upstream_failure(url, "relay upstream closed the stream")
+                    return
+                received = len(chunk)
+                view[pending:pending + received] = chunk
+                pending += received
+                window_bytes += received
+
+                elapsed = time.monotonic() - window_start
+                if elapsed >= self.stall_seconds:
+                    speed = window_bytes / 1024 / elapsed
+                    if speed < self.min_speed:
+                        self.on_upstream_failure(url, f"relay throughput {speed:.0f} KB/s below {self.min_speed} KB/s")
+                        return
+                    window_start, window_bytes = time.monotonic(), 0
+
+                if not aligned:
+                    offset = find_sync(buffer, pending)
+                    if offset == -1:
+                        # 保留可能包含包边界开头的尾部，其余丢弃
+                        keep = min(pending, (SYNC_PACKETS - 1) * TS_PACKET_SIZE)
+                        view[:keep] = view[pending - keep:pending]
+                        pending = keep
+                        continue
+                    view[:pending - offset] = view[offset:pending]
+                    pending -= offset
+                    aligned = True
+
+                whole = pending - pending % TS_PACKET_SIZE
+                if whole:
+                    # WSGI 服务器异步发送数据，缓冲区会被复用，因此交出一份独立的副本
+                    yield bytes(view[:whole])
+                    rest = pending - whole
+                    view[:rest] = view[whole:pending]
+                    pending = rest
+        finally:
+            response.close()